@@ -0,0 +1,255 @@
+"""Hand-written scanners for the hot SVLexer rules.
+
+This module is plain Python so the lexer never depends on it being built, but
+it is written to be compiled with mypyc:
+
+    pip install mypy
+    mypyc sv_accel.py
+
+which leaves an extension module next to this file. When that extension is
+importable, SVLexer uses these scanners for whitespace, comments, strings,
+number literals and the runs of unmatched identifier characters in the root
+state, and falls back to its regex rules for everything else.
+
+Every scanner reproduces one regex of the lexer exactly, including its
+backtracking; a scanner that cannot decide returns -1 (or NOMATCH) and the
+regex rules take over. Changing a rule in sv_lexer.py means revisiting the
+matching scanner here.
+"""
+
+from typing import Tuple
+
+COMPILED = not __file__.endswith(".py")
+
+# Token kinds returned by scan_root.
+NOMATCH = 0
+WHITESPACE = 1
+LINE_COMMENT = 2
+BLOCK_COMMENT = 3
+STRING = 4
+NUMBER = 5
+BIT = 6
+EXP = 7
+DECIMAL = 8
+TIME = 9
+ERROR_RUN = 10
+
+_BASES = {
+    "b": ("01xXzZ?", "01_xXzZ?"),
+    "B": ("01xXzZ?", "01_xXzZ?"),
+    "o": ("01234567xXzZ?", "01234567_xXzZ?"),
+    "O": ("01234567xXzZ?", "01234567_xXzZ?"),
+    "d": ("0123456789xXzZ?", "0123456789_xXzZ?"),
+    "D": ("0123456789xXzZ?", "0123456789_xXzZ?"),
+    "h": ("0123456789abcdefABCDEFxXzZ?", "0123456789abcdefABCDEF_xXzZ?"),
+    "H": ("0123456789abcdefABCDEFxXzZ?", "0123456789abcdefABCDEF_xXzZ?"),
+}
+_ASCII_WORD = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_"
+_TIME_UNITS = ("fs", "ps", "ns", "us", "ms", "s")
+# Words that start a root rule without a leading \b, so they can match in the
+# middle of an identifier.
+_UNGUARDED = ("primitive", "package", "constraint", "interface", "covergroup",
+              "program", "coverpoint", "cross", "inside")
+
+
+def is_word(c: str) -> bool:
+    # Same definition as \w for str patterns.
+    return c.isalnum() or c == "_"
+
+
+def _boundary_after(text: str, pos: int) -> bool:
+    # \b after a word character.
+    return pos >= len(text) or not is_word(text[pos])
+
+
+def scan_whitespace(text: str, pos: int) -> int:
+    # \s*
+    end = len(text)
+    while pos < end and text[pos].isspace():
+        pos += 1
+    return pos
+
+
+def scan_identifier(text: str, pos: int) -> int:
+    # [a-zA-Z0-9_]*
+    end = len(text)
+    while pos < end and text[pos] in _ASCII_WORD:
+        pos += 1
+    return pos
+
+
+def scan_word(text: str, pos: int) -> int:
+    # \w*
+    end = len(text)
+    while pos < end and is_word(text[pos]):
+        pos += 1
+    return pos
+
+
+def scan_line_comment(text: str, pos: int) -> int:
+    # .*$\n?
+    nl = text.find("\n", pos)
+    return len(text) if nl < 0 else nl + 1
+
+
+def scan_block_comment(text: str, pos: int) -> int:
+    # (.*?)(?=\*/) -- the body of a block comment up to a terminator on the
+    # same line, or -1 when the line has none.
+    close = text.find("*/", pos)
+    if close < 0:
+        return -1
+    nl = text.find("\n", pos, close)
+    return close if nl < 0 else -1
+
+
+def scan_string(text: str, pos: int) -> int:
+    # [^"]*
+    close = text.find('"', pos)
+    return len(text) if close < 0 else close
+
+
+def scan_based_number(text: str, pos: int) -> int:
+    # (\b\d+)?'(s?[bB]\s*[0-1xXzZ?][0-1_xXzZ?]*|...)((e|E)(\+|-)?[0-9]+)?(?!'|\w)
+    end = len(text)
+    i = pos
+    if i < end and text[i].isdecimal():
+        if pos > 0 and is_word(text[pos - 1]):
+            return -1
+        while i < end and text[i].isdecimal():
+            i += 1
+    if i >= end or text[i] != "'":
+        return -1
+    i += 1
+    if i < end and text[i] == "s":
+        i += 1
+    if i >= end or text[i] not in _BASES:
+        return -1
+    first, rest = _BASES[text[i]]
+    i = scan_whitespace(text, i + 1)
+    if i >= end or text[i] not in first:
+        return -1
+    start = i + 1
+    i = start
+    while i < end and text[i] in rest:
+        i += 1
+    # The digit run backtracks one character at a time until the optional
+    # exponent and the (?!'|\w) lookahead are satisfied.
+    k = i
+    while k >= start:
+        if k < end and text[k] in "eE":
+            j = k + 1
+            if j < end and text[j] in "+-":
+                j += 1
+            digits = j
+            while j < end and "0" <= text[j] <= "9":
+                j += 1
+            if j > digits and (j >= end or (text[j] != "'" and not is_word(text[j]))):
+                return j
+        if k >= end or (text[k] != "'" and not is_word(text[k])):
+            return k
+        k -= 1
+    return -1
+
+
+def scan_exp_number(text: str, pos: int) -> int:
+    # \b((\d[\d_]*)(e|E)(\+|-)?[0-9]+)\b, with the leading \b already checked
+    end = len(text)
+    i = pos + 1
+    while i < end and (text[i].isdecimal() or text[i] == "_"):
+        i += 1
+    if i >= end or text[i] not in "eE":
+        return -1
+    i += 1
+    if i < end and text[i] in "+-":
+        i += 1
+    digits = i
+    while i < end and "0" <= text[i] <= "9":
+        i += 1
+    if i > digits and _boundary_after(text, i):
+        return i
+    return -1
+
+
+def scan_decimal(text: str, pos: int) -> int:
+    # \b(\d[\d_]*)\b, with the leading \b already checked
+    end = len(text)
+    i = pos + 1
+    while i < end and (text[i].isdecimal() or text[i] == "_"):
+        i += 1
+    return i if _boundary_after(text, i) else -1
+
+
+def scan_time(text: str, pos: int) -> int:
+    # \b(\d+(fs|ps|ns|us|ms|s)?)\b, with the leading \b already checked
+    end = len(text)
+    i = pos + 1
+    while i < end and text[i].isdecimal():
+        i += 1
+    for unit in _TIME_UNITS:
+        if text.startswith(unit, i) and _boundary_after(text, i + len(unit)):
+            return i + len(unit)
+    return i if _boundary_after(text, i) else -1
+
+
+def scan_root(text: str, pos: int) -> Tuple[int, int]:
+    # Decide the token at ``pos`` in the root state. Returns (kind, end), or
+    # (NOMATCH, pos) when the regex rules have to decide.
+    c = text[pos]
+    if c.isspace():
+        # r'\s+' is the first root rule.
+        return WHITESPACE, scan_whitespace(text, pos)
+    if c == "/":
+        # Only the PSL rules come before the comment rules at a slash.
+        nxt = text[pos + 1:pos + 2]
+        if nxt == "/" or nxt == "*":
+            if text.startswith("psl", scan_whitespace(text, pos + 2)):
+                return NOMATCH, pos
+            if nxt == "/":
+                return LINE_COMMENT, scan_line_comment(text, pos + 2)
+            return BLOCK_COMMENT, pos + 2
+        return NOMATCH, pos
+    if c == '"':
+        return STRING, pos + 1
+    if c == "'":
+        # The operator rules come first and own '{.
+        if text.startswith("'{", pos):
+            return NOMATCH, pos
+        end = scan_based_number(text, pos)
+        if end >= 0:
+            return NUMBER, end
+        if pos + 1 < len(text) and text[pos + 1] in "01xXzZ":
+            return BIT, pos + 2
+        return NOMATCH, pos
+    if c in _ASCII_WORD:
+        if pos > 0 and is_word(text[pos - 1]):
+            # In the middle of a word every rule guarded by \b or ^ fails,
+            # which leaves a handful of rules starting with a bare keyword.
+            # If none of them can match, the regex lexer would emit one Error
+            # token per character up to the end of the word.
+            end = scan_identifier(text, pos)
+            for word in _UNGUARDED:
+                if text.find(word, pos, end) >= 0:
+                    return NOMATCH, pos
+            after = scan_whitespace(text, end)
+            if text.startswith(":", after) or end < len(text) and is_word(text[end]):
+                return NOMATCH, pos
+            return ERROR_RUN, end
+        if c.isdecimal():
+            # \w+ followed by '(' or ':' can start the function call or the
+            # SVA label rules, which come before the constants.
+            after = scan_whitespace(text, scan_word(text, pos))
+            if after < len(text) and text[after] in "(:":
+                return NOMATCH, pos
+            end = scan_based_number(text, pos)
+            if end >= 0:
+                return NUMBER, end
+            end = scan_exp_number(text, pos)
+            if end >= 0:
+                return EXP, end
+            end = scan_decimal(text, pos)
+            if end >= 0:
+                return DECIMAL, end
+            end = scan_time(text, pos)
+            if end >= 0:
+                return TIME, end
+    return NOMATCH, pos
@@ -0,0 +1,133 @@
+"""Compare SVLexer against the SystemVerilogLexer shipped with Pygments.
+
+For every file of a corpus this reports how long each lexer takes, how many
+Error/Invalid tokens each one produces, whether the token values join back to
+the input, and which SV_TYPES entries SVLexer emitted. Run it as
+
+    python sv_compare.py [--repeat N] [--output report.json] PATH...
+
+where PATH is a file or a directory searched for *.sv/*.svh files. The report
+is written as JSON so successive runs can be diffed or tracked over time.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+from pygments.lexers import SystemVerilogLexer
+from pygments.token import Error, Token
+
+from sv_lexer import SVLexer, SV_TYPES
+
+EXTENSIONS = (".sv", ".svh", ".v", ".vh")
+
+
+def find_sources(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith(EXTENSIONS):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def lex(lexer, text):
+    return [(ttype, value) for _, ttype, value in lexer.get_tokens_unprocessed(text)]
+
+
+def best_time(lexer, text, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in lexer.get_tokens_unprocessed(text):
+            pass
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def summarize(tokens, text):
+    bad = sum(1 for ttype, _ in tokens if ttype in Error or ttype in Token.Invalid)
+    return {
+        "tokens": len(tokens),
+        "error_tokens": bad,
+        "error_rate": bad / len(tokens) if tokens else 0.0,
+        "roundtrip": "".join(value for _, value in tokens) == text,
+    }
+
+
+def compare_file(path, repeat, lexers):
+    with open(path, encoding="utf-8", errors="replace") as f:
+        text = f.read()
+    ours, theirs = lexers
+    our_tokens = lex(ours, text)
+    their_tokens = lex(theirs, text)
+    our_time = best_time(ours, text, repeat)
+    their_time = best_time(theirs, text, repeat)
+    coverage = Counter(ttype for ttype, _ in our_tokens if ttype in SV_TYPES)
+    return {
+        "path": path,
+        "chars": len(text),
+        "sv": dict(summarize(our_tokens, text), seconds=our_time),
+        "pygments": dict(summarize(their_tokens, text), seconds=their_time),
+        "speed_ratio": our_time / their_time if their_time else None,
+        # Keyed by token type: several types share a CSS class in SV_TYPES.
+        "coverage": {str(ttype): n for ttype, n in sorted(coverage.items())},
+    }
+
+
+def compare(paths, repeat=3):
+    lexers = (SVLexer(), SystemVerilogLexer())
+    files = [compare_file(path, repeat, lexers) for path in find_sources(paths)]
+    totals = {}
+    for name in ("sv", "pygments"):
+        tokens = sum(f[name]["tokens"] for f in files)
+        bad = sum(f[name]["error_tokens"] for f in files)
+        totals[name] = {
+            "seconds": sum(f[name]["seconds"] for f in files),
+            "tokens": tokens,
+            "error_tokens": bad,
+            "error_rate": bad / tokens if tokens else 0.0,
+            "roundtrip_failures": [f["path"] for f in files if not f[name]["roundtrip"]],
+        }
+    coverage = Counter()
+    for f in files:
+        coverage.update(f["coverage"])
+    seen = set(coverage)
+    return {
+        "files": files,
+        "totals": totals,
+        "speed_ratio": (totals["sv"]["seconds"] / totals["pygments"]["seconds"]
+                        if totals["pygments"]["seconds"] else None),
+        "coverage": dict(sorted(coverage.items())),
+        "unused_types": sorted({str(ttype) for ttype in SV_TYPES} - seen),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="+", metavar="PATH")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="timing runs per file, the best one is kept")
+    parser.add_argument("--output", "-o", help="write the JSON report here")
+    args = parser.parse_args(argv)
+
+    report = compare(args.paths, max(1, args.repeat))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
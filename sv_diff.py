@@ -0,0 +1,500 @@
+"""Diff-aware highlighting of two versions of an SV file.
+
+The old version is lexed once, keeping the lexer state at the start of each
+line; lex_version() does this ahead of time, and every DiffHighlight carries
+the new version in the same form, so a review tool that keeps it never lexes
+a version twice. The new version is only lexed around the changed lines: as
+soon as lexing the new text reaches the start of an unchanged line in the
+state the old text had there, the old lines are reused up to the end of that
+block, and lexing picks up again ``context`` lines (at least one) before the
+next change, or further back where a rule matched there could have read up
+to the change: a rule looking ahead for "(" across blank lines, say. How far
+each rule can read is worked out from its regex (sv_tune.reads()).
+
+The line diff is taken from the caller when it has one; otherwise the lines
+the two versions share at the start and end are matched first, and
+SequenceMatcher only compares what is left.
+
+Tokens come back split into lines and tagged: "deleted" and "inserted" for
+the tokens that differ between the two sides of a changed hunk, "retyped"
+for unchanged text that lexes differently because of a change before it, and
+None for everything else.
+
+    python sv_diff.py OLD NEW [--context N] [--check] [--bench]
+
+prints a word diff of the two files; --check also lexes the whole new file
+and compares the result, then does the same for a series of random edits
+made on top of NEW (--edits N), and --bench times lexing both files in full
+against diff_highlight, with and without the old version already lexed.
+"""
+
+import argparse
+import random
+import re
+import sys
+import time
+from bisect import bisect_left, bisect_right
+from difflib import SequenceMatcher
+
+from sv_fuzz import fragment
+from sv_lexer import SVLexer
+from sv_tune import char_class, reads, single_run
+
+
+class LexedVersion:
+
+    def __init__(self, text, lines, states):
+        self.text = text
+        # Tuples of (tokentype, value, None), one per line of ``text``.
+        self.lines = lines
+        # The lexer state stack at the start of each line, and at the end of
+        # the text, or None where a token runs across the line start.
+        self.states = states
+
+
+class DiffHighlight:
+
+    def __init__(self, old_lines, new_lines, opcodes, relexed, new_version):
+        # Lists of lines, each a tuple of (tokentype, value, tag). Lines that
+        # are not changed are shared with the LexedVersions.
+        self.old_lines = old_lines
+        self.new_lines = new_lines
+        # difflib opcodes over the lines of the two versions.
+        self.opcodes = opcodes
+        # Number of characters of the new version that had to be lexed.
+        self.relexed = relexed
+        # The new version, ready to be passed as ``old`` to the next diff.
+        self.new_version = new_version
+
+
+def text_lines(text):
+    # The lines of ``text``, each with its "\n". Unlike str.splitlines,
+    # only "\n" ends a line, as for the lexer.
+    lines = text.split("\n")
+    last = lines.pop()
+    lines = [line + "\n" for line in lines]
+    if last:
+        lines.append(last)
+    return lines
+
+
+def _line_starts(lines):
+    starts = [0]
+    for line in lines:
+        starts.append(starts[-1] + len(line))
+    return starts
+
+
+def _split_lines(text, spans):
+    # Split (tokentype, start, end) spans into lines of (tokentype, value).
+    lines = [[]]
+    for ttype, start, end in spans:
+        parts = text[start:end].split("\n")
+        for i, part in enumerate(parts):
+            if i:
+                lines[-1].append((ttype, "\n"))
+                lines.append([])
+            if part:
+                lines[-1].append((ttype, part))
+    if not lines[-1]:
+        lines.pop()
+    return lines
+
+
+def _untagged(lines):
+    return [tuple((t, v, None) for t, v in line) for line in lines]
+
+
+def _recorder(starts, states, first=0):
+    # A mark() callback for SVLexer.get_spans that fills in states[n] for
+    # each line start starts[n], from line ``first`` on: the state stack at
+    # the last match boundary at or before the line start, and how far back
+    # that boundary is.
+    shared = {}
+    line = [first]
+    previous = [None, 0]
+
+    def mark(pos, statestack):
+        stack = tuple(statestack)
+        stack = shared.setdefault(stack, stack)
+        n = line[0]
+        while n < len(starts) and starts[n] <= pos:
+            if starts[n] == pos:
+                states[n] = (stack, 0)
+            else:
+                states[n] = (previous[0], starts[n] - previous[1])
+            n += 1
+        line[0] = n
+        previous[0] = stack
+        previous[1] = pos
+
+    return mark
+
+
+def lex_version(text, lexer=None):
+    # Lex one version of a file for diff_highlight(). A review tool that
+    # keeps the result (or DiffHighlight.new_version) for the base of the
+    # next diff does not lex that version again.
+    lexer = lexer or SVLexer()
+    starts = _line_starts(text_lines(text))
+    states = [None] * len(starts)
+    spans = lexer.get_spans(text, 0, ["root"], _recorder(starts, states))
+    return LexedVersion(text, _untagged(_split_lines(text, spans)), states)
+
+
+def line_opcodes(old_lines, new_lines):
+    # difflib opcodes between two lists of lines. Lines common to the start
+    # and end are matched first, in linear time, so that SequenceMatcher
+    # only sees the part that changed.
+    n = min(len(old_lines), len(new_lines))
+    head = 0
+    while head < n and old_lines[head] == new_lines[head]:
+        head += 1
+    tail = 0
+    while (tail < n - head
+           and old_lines[len(old_lines) - 1 - tail] == new_lines[len(new_lines) - 1 - tail]):
+        tail += 1
+    old_end = len(old_lines) - tail
+    new_end = len(new_lines) - tail
+    middle = SequenceMatcher(None, old_lines[head:old_end], new_lines[head:new_end])
+    opcodes = [("equal", 0, head, 0, head)] if head else []
+    for tag, i1, i2, j1, j2 in middle.get_opcodes():
+        opcodes.append((tag, i1 + head, i2 + head, j1 + head, j2 + head))
+    if tail:
+        opcodes.append(("equal", old_end, len(old_lines), new_end, len(new_lines)))
+    # Merge equal blocks that ended up next to each other.
+    merged = []
+    for op in opcodes:
+        if merged and op[0] == "equal" == merged[-1][0]:
+            merged[-1] = ("equal", merged[-1][1], op[2], merged[-1][3], op[4])
+        elif op[1] < op[2] or op[3] < op[4]:
+            merged.append(op)
+    return merged
+
+
+def _check_opcodes(opcodes, old_count, new_count):
+    i = j = 0
+    for tag, i1, i2, j1, j2 in opcodes:
+        if (i1, j1) != (i, j) or i2 < i1 or j2 < j1 or (tag == "equal" and i2 - i1 != j2 - j1):
+            raise ValueError("opcodes do not cover the lines of both versions")
+        i, j = i2, j2
+    if (i, j) != (old_count, new_count):
+        raise ValueError("opcodes do not cover the lines of both versions")
+
+
+_lookaheads = {}
+
+
+def _lookahead(lexer):
+    # How far the rules of ``lexer`` can read past where they are tried, as
+    # (lines, runs): rules that read past a bounded number of "\n" read past
+    # at most ``lines``; each of the others reads through the characters
+    # matched by ``run`` and at most ``fixed`` others, for each (run, fixed)
+    # in ``runs``. A rule that is one greedy repeat of a character set reads
+    # only one character past the end of its match, so it cannot reach past
+    # the next match boundary and is left out.
+    cls = type(lexer)
+    if cls not in _lookaheads:
+        lines = 0
+        runs = {}
+        for rules in cls.get_tokendefs().values():
+            for rule in rules:
+                if single_run(rule[0], cls.flags):
+                    continue
+                newlines, fixed, mask = reads(rule[0], cls.flags)
+                if newlines is None:
+                    runs[mask] = max(fixed, runs.get(mask, 0))
+                else:
+                    lines = max(lines, newlines)
+        _lookaheads[cls] = lines, [(re.compile(char_class(mask) + "*"), fixed)
+                                   for mask, fixed in runs.items()]
+    return _lookaheads[cls]
+
+
+def _stops(run, fixed, text, pos, end):
+    # Whether text[pos:end] has more than ``fixed`` characters ``run`` does
+    # not match, so that a rule described by (run, fixed) cannot read
+    # through all of it.
+    for _ in range(fixed + 1):
+        pos = run.match(text, pos, end).end()
+        if pos == end:
+            return False
+        pos += 1
+    return True
+
+
+def _reusable(old, old_starts, i1, i2, context, lookahead):
+    # The old lines i1..i2 are followed by a change. Return the line up to
+    # which their tokens stay the same whatever the change is: no rule tried
+    # before that line can read from there up to the change.
+    lines, runs = lookahead
+    end = old_starts[i2]
+    line = max(i1, i2 - max(context, lines))
+    while line > i1 and not all(_stops(run, fixed, old.text, old_starts[line], end)
+                                for run, fixed in runs):
+        line = max(i1, 2 * line - i2)
+    return line
+
+
+def _lex_new(lexer, new, old, opcodes, new_starts, old_starts, context):
+    # Lex ``new``, reusing the lines of the LexedVersion ``old`` wherever an
+    # unchanged block of lines is entered in the same state. Returns the
+    # lines of ``new``, its states at line starts and the number of
+    # characters actually lexed.
+    line_count = len(new_starts) - 1
+    lookahead = _lookahead(lexer)
+    # Runs of new lines whose tokens may be taken from the old version, as
+    # (first line, end line, old line - new line). Unless a block runs to
+    # the end of both versions, its last lines are left out: rules look
+    # ahead, so the tokens there may depend on the change that follows.
+    regions = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal":
+            if j2 == line_count and i2 == len(old_starts) - 1:
+                safe = j2
+            else:
+                safe = j1 + _reusable(old, old_starts, i1, i2, context, lookahead) - i1
+            if safe > j1:
+                regions.append((j1, safe, i1 - j1))
+    region_ends = [end for _, end, _ in regions]
+
+    lines = []
+    states = [None] * (line_count + 1)
+    relexed = 0
+    # Lex from line ``line``, whose state says where the last match before
+    # it starts and with what stack.
+    line = 0
+    stack, back = ("root",), 0
+    while True:
+        resync = []
+        start = new_starts[line]
+        record = _recorder(new_starts, states, line)
+
+        def mark(p, statestack):
+            if resync:
+                return
+            record(p, statestack)
+            # The next line start, and the unchanged block it is in.
+            n = bisect_left(new_starts, p)
+            if n < line:
+                return
+            k = bisect_right(region_ends, n)
+            if k == len(regions) or n < regions[k][0] or n == regions[k][1]:
+                return
+            first, _, delta = regions[k]
+            if p < new_starts[first]:
+                return
+            state = old.states[n + delta]
+            if state[1] == new_starts[n] - p and state[0] == tuple(statestack):
+                resync.append((n, k))
+
+        spans = []
+        for span in lexer.get_spans(new, start - back, list(stack), mark):
+            if span[2] <= start:
+                continue
+            if resync and span[1] >= new_starts[resync[0][0]]:
+                break
+            spans.append(span)
+        if spans and spans[0][1] < start:
+            spans[0] = (spans[0][0], start, spans[0][2])
+        if not resync:
+            lines.extend(_untagged(_split_lines(new, spans)))
+            relexed += len(new) - start
+            return lines, states, relexed
+        n, k = resync[0]
+        if spans and spans[-1][2] > new_starts[n]:
+            spans[-1] = (spans[-1][0], spans[-1][1], new_starts[n])
+        lines.extend(_untagged(_split_lines(new, spans)))
+        relexed += new_starts[n] - start
+        end, delta = regions[k][1], regions[k][2]
+        # Reuse the old lines up to the end of the block, then lex from
+        # there in the state the old version had.
+        lines.extend(old.lines[n + delta:end + delta])
+        states[n:end + 1] = old.states[n + delta:end + delta + 1]
+        if end == line_count:
+            return lines, states, relexed
+        line = end
+        stack, back = old.states[end + delta]
+
+
+def _tag(line, tag):
+    return tuple((t, v, tag) for t, v, _ in line)
+
+
+def _tag_lines(old_lines, new_lines, opcodes):
+    old_tagged = list(old_lines)
+    new_tagged = list(new_lines)
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal":
+            for i, j in zip(range(i1, i2), range(j1, j2)):
+                if old_lines[i] is not new_lines[j] and old_lines[i] != new_lines[j]:
+                    old_tagged[i] = _tag(old_lines[i], "retyped")
+                    new_tagged[j] = _tag(new_lines[j], "retyped")
+            continue
+        # Token-level diff inside the hunk.
+        a = [(i, n) for i in range(i1, i2) for n in range(len(old_lines[i]))]
+        b = [(j, n) for j in range(j1, j2) for n in range(len(new_lines[j]))]
+        matcher = SequenceMatcher(None, [old_lines[i][n][:2] for i, n in a],
+                                  [new_lines[j][n][:2] for j, n in b], autojunk=False)
+        changed_old = {}
+        changed_new = {}
+        for op, a1, a2, b1, b2 in matcher.get_opcodes():
+            if op == "equal":
+                continue
+            for i, n in a[a1:a2]:
+                changed_old.setdefault(i, set()).add(n)
+            for j, n in b[b1:b2]:
+                changed_new.setdefault(j, set()).add(n)
+        for tagged, lines, changed, mark in ((old_tagged, old_lines, changed_old, "deleted"),
+                                             (new_tagged, new_lines, changed_new, "inserted")):
+            for i, indices in changed.items():
+                tagged[i] = tuple((t, v, mark if n in indices else None)
+                                  for n, (t, v, _) in enumerate(lines[i]))
+    return old_tagged, new_tagged
+
+
+def diff_highlight(old, new, lexer=None, context=2, opcodes=None):
+    # Highlight two versions of a file, lexing the new one only around the
+    # lines that changed. See the module docstring for the result.
+    #
+    # ``old`` is the old text or its LexedVersion, made with the same kind
+    # of lexer. ``opcodes`` are difflib-style opcodes over the lines of the
+    # two versions (text_lines()), for callers that already have the diff;
+    # without them the lines are diffed here.
+    if context < 1:
+        raise ValueError("context must be at least 1 line")
+    lexer = lexer or SVLexer()
+    if not isinstance(old, LexedVersion):
+        old = lex_version(old, lexer)
+    old_text_lines = text_lines(old.text)
+    new_text_lines = text_lines(new)
+    if opcodes is None:
+        opcodes = line_opcodes(old_text_lines, new_text_lines)
+    else:
+        opcodes = list(opcodes)
+        _check_opcodes(opcodes, len(old_text_lines), len(new_text_lines))
+    lines, states, relexed = _lex_new(lexer, new, old, opcodes, _line_starts(new_text_lines),
+                                      _line_starts(old_text_lines), context)
+    new_version = LexedVersion(new, lines, states)
+    old_tagged, new_tagged = _tag_lines(old.lines, lines, opcodes)
+    return DiffHighlight(old_tagged, new_tagged, opcodes, relexed, new_version)
+
+
+def bench(old, new, lexer, context, repeat=3):
+    def best(function):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    def full():
+        _split_lines(old, lexer.get_spans(old))
+        _split_lines(new, lexer.get_spans(new))
+
+    base = lex_version(old, lexer)
+    full_time = best(full)
+    cold = best(lambda: diff_highlight(old, new, lexer, context))
+    warm = best(lambda: diff_highlight(base, new, lexer, context))
+    print(f"lex both files:               {full_time:.3f}s")
+    print(f"diff_highlight:               {cold:.3f}s ({full_time / cold:.1f}x)")
+    print(f"diff_highlight, old reused:   {warm:.3f}s ({full_time / warm:.1f}x)")
+    return 0
+
+
+def random_edit(text, rng):
+    # ``text`` with a few lines deleted or cut short, and random fragments,
+    # blank lines or lone brackets and comment marks put in.
+    lines = text_lines(text)
+    for _ in range(rng.randint(1, 4)):
+        k = rng.randint(0, len(lines))
+        op = rng.random()
+        if op < 0.25:
+            del lines[k:k + rng.randint(1, 3)]
+        elif op < 0.5:
+            lines.insert(k, fragment(rng) + "\n")
+        elif op < 0.75:
+            lines.insert(k, rng.choice(["\n", "\n\n", "(\n", ");\n", "= foo\n", "foo\n",
+                                        "/*\n", "*/\n", '"\n', "// (\n"]))
+        elif k < len(lines):
+            lines[k] = lines[k][:rng.randint(0, len(lines[k]) - 1)] + "\n"
+    return "".join(lines)
+
+
+def check(result, lexer, context, edits, seed=0):
+    # Compare the new side of ``result`` with lexing the whole new text,
+    # then do the same for ``edits`` random edits, each diffed against the
+    # version before it. Returns the number of mismatches.
+    rng = random.Random(seed)
+    mismatches = 0
+    for n in range(edits + 1):
+        new = result.new_version.text
+        full = _split_lines(new, lexer.get_spans(new))
+        for line, (got, want) in enumerate(zip(result.new_lines, full)):
+            if [(t, v) for t, v, _ in got] != want:
+                where = "the new file" if n == 0 else f"random edit {n}"
+                print(f"{where}: line {line + 1} differs from a full lex", file=sys.stderr)
+                mismatches += 1
+                break
+        if n < edits:
+            result = diff_highlight(result.new_version, random_edit(new, rng), lexer, context)
+    return mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("old", metavar="OLD")
+    parser.add_argument("new", metavar="NEW")
+    parser.add_argument("--context", type=int, default=2,
+                        help="lines before each change that are always lexed again (at least 1)")
+    parser.add_argument("--check", action="store_true",
+                        help="compare with lexing the whole new file, and check random edits")
+    parser.add_argument("--edits", type=int, default=20, metavar="N",
+                        help="random edits tried by --check (default 20)")
+    parser.add_argument("--bench", action="store_true",
+                        help="time lexing both files in full against diff_highlight")
+    args = parser.parse_args(argv)
+    if args.context < 1:
+        parser.error("--context must be at least 1")
+
+    with open(args.old, encoding="utf-8", errors="replace") as f:
+        old = f.read()
+    with open(args.new, encoding="utf-8", errors="replace") as f:
+        new = f.read()
+    lexer = SVLexer()
+    if args.bench:
+        return bench(old, new, lexer, args.context)
+    result = diff_highlight(old, new, lexer, args.context)
+
+    def show(line, prefix):
+        out = []
+        for _, value, tag in line:
+            value = value.rstrip("\n")
+            if tag == "deleted":
+                value = "[-" + value + "-]"
+            elif tag == "inserted":
+                value = "{+" + value + "+}"
+            out.append(value)
+        print(prefix + "".join(out))
+
+    for tag, i1, i2, j1, j2 in result.opcodes:
+        if tag == "equal":
+            for j in range(j1, j2):
+                if any(t == "retyped" for _, _, t in result.new_lines[j]):
+                    show(result.new_lines[j], "~")
+            continue
+        print(f"@@ -{i1 + 1},{i2 - i1} +{j1 + 1},{j2 - j1} @@")
+        for i in range(i1, i2):
+            show(result.old_lines[i], "-")
+        for j in range(j1, j2):
+            show(result.new_lines[j], "+")
+    print(f"lexed {result.relexed} of {len(new)} characters of {args.new}", file=sys.stderr)
+
+    if args.check and check(result, lexer, args.context, args.edits):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
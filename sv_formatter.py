@@ -1,6 +1,35 @@
 """An SV plugin formatter for Pygments."""
 
+import codecs
+from io import BytesIO, StringIO
+from types import MappingProxyType
+
+from pygments import highlight
 from pygments.formatter import Formatter
+from pygments.token import STANDARD_TYPES
+
+from sv_lexer import SV_TYPES
+
+
+def token_color(style, ttype):
+    while not style.styles_token(ttype):
+        ttype = ttype.parent
+    return style.style_for_token(ttype)['color'] or "black"
+
+
+def highlight_spans(code, lexer, formatter, outfile=None):
+    # pygments.highlight(), except that when the lexer can produce spans and
+    # the formatter can write them, no token value is ever copied out of the
+    # source: the formatter slices the text itself as it writes. Filters
+    # work on values, so lexers with filters go through highlight().
+    if (not hasattr(lexer, "get_spans") or not hasattr(formatter, "format_spans")
+            or lexer.filters):
+        return highlight(code, lexer, formatter, outfile)
+    text = lexer._preprocess_lexer_input(code)
+    realoutfile = outfile or (BytesIO() if formatter.encoding else StringIO())
+    formatter.format_spans(text, lexer.get_spans(text), realoutfile)
+    if not outfile:
+        return realoutfile.getvalue()
 
 class SVFormatter(Formatter):
     # This should be the human-readable name of the format.
@@ -31,11 +60,36 @@ class SVFormatter(Formatter):
     # will return an instance of this formatter class.
     filenames = ["*.svfmt"]
 
+    def __init__(self, **options):
+        super().__init__(**options)
+        # The color of every known token type is looked up once, here. The
+        # table is read-only afterwards, so one formatter can be shared by
+        # many threads as long as each call writes to its own output.
+        self._prefixes = MappingProxyType({
+            ttype: "[" + token_color(self.style, ttype) + "]"
+            for ttype in set(SV_TYPES) | set(STANDARD_TYPES)
+        })
+
     def format_unencoded(self, tokensource, out):
         # This formatter writes each token as [<color>]<string> .
+        prefixes = self._prefixes
         for ttype, value in tokensource:
-            while not self.style.styles_token(ttype):
-                ttype = ttype.parent
-            color = self.style.style_for_token(ttype)['color']
-            out.write("[" + (color or "black") + "]")
+            prefix = prefixes.get(ttype)
+            if prefix is None:
+                prefix = "[" + token_color(self.style, ttype) + "]"
+            out.write(prefix)
             out.write(value)
+
+    def format_spans(self, text, spans, outfile):
+        # Same output as format(), from the (tokentype, start, end) spans of
+        # SVLexer.get_spans over ``text``.
+        if self.encoding:
+            outfile = codecs.lookup(self.encoding)[3](outfile)
+        prefixes = self._prefixes
+        write = outfile.write
+        for ttype, start, end in spans:
+            prefix = prefixes.get(ttype)
+            if prefix is None:
+                prefix = "[" + token_color(self.style, ttype) + "]"
+            write(prefix)
+            write(text[start:end])
@@ -0,0 +1,243 @@
+"""Round-trip checks for SVLexer.
+
+Every character of the input has to come back out of the lexer: joining the
+values of the token stream must give back the exact input text. There are two
+ways to check this:
+
+    python sv_fuzz.py --audit
+
+is the fast mode. It does not lex anything, it walks the parsed regex of every
+bygroups rule and reports text that is matched outside of a group with an
+action (and would therefore be dropped), groups nested in another group with
+an action (which would be emitted twice), or groups with an action inside a
+repeat (only the last iteration of which would be emitted).
+
+    python sv_fuzz.py [--iterations N] [--seed S]
+
+generates random SystemVerilog fragments, lexes them and checks that the
+tokens join back to the input. Failing inputs are shrunk before reporting.
+"""
+
+import argparse
+import random
+import re
+import sys
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_constants
+    import sre_parse
+
+from sv_lexer import SVLexer
+
+_ZERO_WIDTH = (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT)
+_REPEATS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT,
+            getattr(sre_constants, "POSSESSIVE_REPEAT", sre_constants.MAX_REPEAT))
+
+
+def bygroups_actions(action):
+    # sv_lexer.bygroups records its actions on the callback; the callbacks of
+    # pygments.lexer.bygroups keep them in their closure. Anything else is a
+    # hand-written callback, which only the fuzzer can check.
+    actions = getattr(action, "actions", None)
+    if actions is not None:
+        return actions
+    if getattr(action, "__name__", None) != "callback" or not action.__closure__:
+        return None
+    for cell in action.__closure__:
+        if isinstance(cell.cell_contents, tuple):
+            return cell.cell_contents
+    return None
+
+
+def _audit(items, covered, problems, inside=False, repeated=False):
+    for op, av in items:
+        if op is sre_constants.SUBPATTERN:
+            group = av[0]
+            if group in covered:
+                if inside:
+                    problems.add(f"group {group} is nested in another group with an action")
+                if repeated:
+                    problems.add(f"group {group} is repeated; only its last iteration is emitted")
+                _audit(av[-1], covered, problems, True, repeated)
+            else:
+                _audit(av[-1], covered, problems, inside, repeated)
+        elif op in _ZERO_WIDTH:
+            continue
+        elif op in _REPEATS:
+            _audit(av[2], covered, problems, inside, repeated or av[1] > 1)
+        elif op is sre_constants.BRANCH:
+            for branch in av[1]:
+                _audit(branch, covered, problems, inside, repeated)
+        elif not inside:
+            problems.add("text matched outside of a group with an action")
+
+
+def audit(lexer_class=SVLexer):
+    # Return a list of (state, index, regex, problem) for every bygroups rule
+    # that can drop or duplicate text.
+    findings = []
+    for state, rules in lexer_class.tokens.items():
+        for index, rule in enumerate(rules):
+            actions = bygroups_actions(rule[1])
+            if actions is None:
+                continue
+            covered = {i + 1 for i, action in enumerate(actions) if action is not None}
+            problems = set()
+            _audit(sre_parse.parse(rule[0], lexer_class.flags), covered, problems)
+            for problem in sorted(problems):
+                findings.append((state, index, rule[0], problem))
+    return findings
+
+
+IDENTIFIERS = ["a", "clk", "rst_n", "data_q", "WIDTH", "my_if", "mp", "pkg", "u_dut", "cg", "cp"]
+TYPES = ["logic", "bit", "int", "wire", "my_t", "uvm_object", "string"]
+NUMBERS = ["0", "1", "42", "8'hFF", "4'b10_x1", "'0", "'1", "3'd7", "1.5e3", "10ns", "32'sh_dead"]
+SPACES = [" ", "  ", "\t", "\n", " \n  ", ""]
+
+TEMPLATES = [
+    "module {i} #(parameter {I} = {n}) ({d} {t} [{n}:{n}] {i}, {d} {i});",
+    "module {i};",
+    "endmodule{s}:{s}{i}",
+    "function {t} {i}({d} {t} {i}[{n}:{n}], {i}::{t} {i});",
+    "task automatic {i};",
+    "task {i}{s};",
+    "typedef struct packed {{ {t} {i}; }} {i};",
+    "typedef enum {{ {I}, {I} }} {i};",
+    "typedef class {i};",
+    "typedef {i} #({t}) {i};",
+    "typedef {t} [{n}:0] {i};",
+    "struct {s}packed{s}{{ {t} {i}; }}{s}{i}{s};",
+    "union {{ {t} {i}; }} {i};",
+    "bind {i}.{i} {i} #(.{i}({n})) {i}(.*);",
+    "{s}bind{s} {i} {i}{s}#({n}) {i} (.{i}({i}), .{i});",
+    "{i} {i}{s}[{n}:{n}]{s}(.{i}{s}({i}), .{i}{s});",
+    "{i} {i} ({i}, {i});",
+    "{i}.{i} {i};",
+    "begin{s}:{s}{i}",
+    "fork : {i} join_none",
+    "end{s}:{s}{i}",
+    "property {i}; @(posedge {i}) {i} |-> {i}; endproperty",
+    "{i}{s}:{s}assert property ({i});",
+    "// psl {i}{s}:{s}assert always {i};",
+    "//{s}psl default clock = (posedge {i});",
+    "/* psl\n{s}{i}{s}:{s}assert never ({i});\n*/",
+    "/* {i} {n} */",
+    "// {i} {n}",
+    "{i} inside {{{i}, {i}}};",
+    "covergroup {i} @(posedge {i});",
+    "{i}{s}:{s}coverpoint {i};",
+    "{s}cross {i}, {i};",
+    "{s}option.per_instance = 1;",
+    "{s}localparam {I} = {n};",
+    "{s}parameter {i}{s}= {n};",
+    "{s}local rand {i}::{t} {i};",
+    "{s}protected const {t} {i} = {n};",
+    "rand {t} {i};",
+    "randc {t} {i};",
+    "virtual class {i} extends {i};",
+    "interface {i};",
+    "package {i};",
+    "constraint {i} {{ {i} inside {{[{n}:{n}]}}; }}",
+    "{i} = '{{{i}: {n}, default: {n}}};",
+    "`ifdef{s} {I}",
+    "`ifndef {I}",
+    "`default_nettype none",
+    "`define {I} {n}",
+    "`include \"{i}.svh\"",
+    "`{i}({i})",
+    "`endif",
+    "$display(\"%0d %s\\n\", {i}, {i});",
+    "\"{i} %5.2f %% %q\"",
+    "{i} = {i}'({i});",
+    "{i} <= {i} + {n} - ({i} << {n}) & ~{i} | {i} ^ {i};",
+    "if ({i} == {n} && !{i} || {i} != {i}) {i} = {i} ? {n} : {n};",
+    "std::randomize({i});",
+    "always_ff @(posedge {i} or negedge {i}) {i} <= #{n} {i};",
+    "assign {i} = {i};",
+]
+
+
+def fragment(rng):
+    def fill(template):
+        return re.sub(r"\{([isntdI])\}", lambda m: {
+            "i": lambda: rng.choice(IDENTIFIERS),
+            "I": lambda: rng.choice(IDENTIFIERS).upper(),
+            "s": lambda: rng.choice(SPACES),
+            "n": lambda: rng.choice(NUMBERS),
+            "t": lambda: rng.choice(TYPES),
+            "d": lambda: rng.choice(["input", "output", "inout", "ref", ""]),
+        }[m.group(1)](), template).replace("{{", "{").replace("}}", "}")
+
+    parts = []
+    for _ in range(rng.randint(1, 8)):
+        parts.append(fill(rng.choice(TEMPLATES)))
+        parts.append(rng.choice(SPACES + ["\n", "\n\n"]))
+    text = "".join(parts)
+    # Some byte-level noise so the rules also see text they were not written
+    # for: truncated declarations, stray punctuation, and so on.
+    for _ in range(rng.randint(0, 3)):
+        pos = rng.randint(0, len(text))
+        if rng.random() < 0.5:
+            text = text[:pos] + text[pos + rng.randint(1, 6):]
+        else:
+            text = text[:pos] + rng.choice("();{}[]:#.,'\"`/*\\ \n\t") + text[pos:]
+    return text
+
+
+def roundtrips(lexer, text):
+    return "".join(value for _, _, value in lexer.get_tokens_unprocessed(text)) == text
+
+
+def shrink(lexer, text):
+    # Greedy delta debugging: keep removing chunks while the input still fails.
+    chunk = len(text) // 2
+    while chunk:
+        pos = 0
+        while pos < len(text):
+            candidate = text[:pos] + text[pos + chunk:]
+            if candidate and not roundtrips(lexer, candidate):
+                text = candidate
+            else:
+                pos += chunk
+        chunk //= 2
+    return text
+
+
+def fuzz(iterations=2000, seed=None, lexer=None):
+    # Return the list of shrunk inputs that did not round-trip.
+    lexer = lexer or SVLexer()
+    rng = random.Random(seed)
+    failures = []
+    for _ in range(iterations):
+        text = fragment(rng)
+        if not roundtrips(lexer, text):
+            small = shrink(lexer, text)
+            if small not in failures:
+                failures.append(small)
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--audit", action="store_true",
+                        help="only check the rule table, do not lex anything")
+    parser.add_argument("--iterations", "-n", type=int, default=2000)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    findings = audit()
+    for state, index, regex, problem in findings:
+        print(f"{state}[{index}]: {problem}\n    {regex}")
+    if args.audit:
+        return 1 if findings else 0
+
+    failures = fuzz(args.iterations, args.seed)
+    for text in failures:
+        print(f"does not round-trip: {text!r}")
+    return 1 if findings or failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+"""An include-graph resolver for SV sources.
+
+Headers pulled in with `include are lexed once and their tokens are kept in a
+shared cache, so every compilation unit that includes the same header reuses
+the same result instead of lexing it again.
+"""
+
+import os
+import re
+import sys
+
+from pygments.token import Token
+
+from sv_lexer import SVLexer
+
+Preprocessor = Token.Constant.Other.Preprocessor
+CommentStart = Token.Punctuation.Definition.Comment
+
+# The file name after `include: a string literal or <name>, on the same line.
+_INCLUDE_NAME = re.compile(r'[ \t]*(?:"([^"\n]*)"|<([^>\n]*)>)')
+
+
+def parse_incdirs(args):
+    # Collect include directories from simulator style arguments, e.g.
+    #
+    #   +incdir+rtl/include+tb/include
+    #
+    # Anything that is not an +incdir+ argument is returned untouched.
+    incdirs = []
+    rest = []
+    for arg in args:
+        if arg.startswith("+incdir+"):
+            incdirs.extend(d for d in arg[len("+incdir+"):].split("+") if d)
+        else:
+            rest.append(arg)
+    return incdirs, rest
+
+
+class IncludeResolver:
+    # Resolves `include directives the way simulators do: first relative to
+    # the directory of the including file, then through each incdir in order.
+    #
+    # Tokens are cached per real path and revalidated with the file's size and
+    # modification time, so a resolver can be kept alive across doc builds.
+    # Only the include names are cached with them; the names are resolved
+    # again on every call, so that a header added to an incdir later, or
+    # one that shadows another, is picked up without the includer changing.
+
+    def __init__(self, incdirs=(), lexer=None, **options):
+        self.incdirs = [os.path.abspath(d) for d in incdirs]
+        self.lexer = lexer or SVLexer(**options)
+        self._cache = {}
+        # (including file, include name) pairs that could not be resolved the
+        # last time the including file's includes were looked up.
+        self.missing = set()
+
+    def resolve(self, name, including=None):
+        search = list(self.incdirs)
+        if including is not None:
+            search.insert(0, os.path.dirname(including))
+        if os.path.isabs(name):
+            search = [""]
+        for directory in search:
+            candidate = os.path.join(directory, name)
+            if os.path.isfile(candidate):
+                return os.path.realpath(candidate)
+        return None
+
+    def _entry(self, path):
+        path = os.path.realpath(path)
+        st = os.stat(path)
+        key = (st.st_size, st.st_mtime_ns)
+        entry = self._cache.get(path)
+        if entry is None or entry[0] != key:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                text = f.read()
+            tokens = tuple(self.lexer.get_tokens(text))
+            names = tuple(self._include_names(tokens))
+            entry = self._cache[path] = (key, tokens, names)
+        return entry
+
+    def _include_names(self, tokens):
+        # The tokens tell `include directives in code apart from the ones in
+        # strings and // comments. Block comments need more: SVLexer goes
+        # back to the root state at each newline, so the lines inside them
+        # come out as code, and every token up to the closing */ is skipped.
+        #
+        # Yields (name, literal) for each directive; a name that is not a
+        # literal is the rest of the line, for reporting.
+        text = "".join(value for _, value in tokens)
+        pos = 0
+        comment_end = 0
+        for ttype, value in tokens:
+            start = pos
+            pos += len(value)
+            if start < comment_end:
+                continue
+            if ttype is CommentStart and value == "/*":
+                close = text.find("*/", pos)
+                comment_end = len(text) if close == -1 else close + 2
+                continue
+            if ttype is not Preprocessor or value != "`include":
+                continue
+            m = _INCLUDE_NAME.match(text, pos)
+            if m is None:
+                # A macro, or no name at all: report what follows.
+                end = text.find("\n", pos)
+                rest = text[pos:len(text) if end == -1 else end]
+                yield rest.split("//")[0].strip(), False
+                continue
+            yield (m.group(1) if m.group(1) is not None else m.group(2)), True
+
+    def get_tokens(self, path):
+        # Return the (tokentype, value) pairs of ``path``, lexing it only if it
+        # is not already cached or changed on disk since it was cached.
+        return self._entry(path)[1]
+
+    def includes(self, path):
+        # The real paths of the headers ``path`` includes directly, as they
+        # resolve now.
+        path = os.path.realpath(path)
+        resolved = []
+        for name, literal in self._entry(path)[2]:
+            header = self.resolve(name, path) if literal else None
+            if header is None:
+                self.missing.add((path, name))
+            else:
+                self.missing.discard((path, name))
+                resolved.append(header)
+        return tuple(resolved)
+
+    def build(self, paths):
+        # Return the include graph reachable from ``paths`` as a dict mapping
+        # each real path to the tuple of headers it includes directly.
+        graph = {}
+        pending = [os.path.realpath(p) for p in paths]
+        while pending:
+            path = pending.pop()
+            if path in graph:
+                continue
+            graph[path] = self.includes(path)
+            pending.extend(graph[path])
+        return graph
+
+    def order(self, paths):
+        # Headers before the files that include them. Include guards make
+        # cycles legal, so back edges are simply ignored.
+        graph = self.build(paths)
+        done = set()
+        active = set()
+        result = []
+
+        def visit(path):
+            if path in done or path in active:
+                return
+            active.add(path)
+            for child in graph[path]:
+                visit(child)
+            active.discard(path)
+            done.add(path)
+            result.append(path)
+
+        for path in sorted(graph):
+            visit(path)
+        return result
+
+
+def main(argv=None):
+    incdirs, paths = parse_incdirs(sys.argv[1:] if argv is None else argv)
+    resolver = IncludeResolver(incdirs)
+    unreadable = [path for path in paths if not os.path.isfile(path)]
+    for path in unreadable:
+        print(f"{path}: no such file", file=sys.stderr)
+    paths = [path for path in paths if path not in unreadable]
+    graph = resolver.build(paths)
+    for path in resolver.order(paths):
+        print(path)
+        for child in graph[path]:
+            print("    " + child)
+    for path, name in sorted(resolver.missing):
+        print(f"{path}: cannot resolve `include \"{name}\"", file=sys.stderr)
+    return 1 if resolver.missing or unreadable else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,294 @@
+"""Line index for highlighting a few lines out of a huge SV file.
+
+The index is a sidecar file (``<source>.svidx``) holding the lexer state stack
+and the byte offset of a resume point every ``interval`` lines. It is built
+once per file, checked against the file's SHA-256 before use, and lets
+highlight_lines() start lexing at the closest resume point before the
+requested lines instead of at the start of the file.
+
+Hashing the file is the expensive part of opening an index, so open_index()
+remembers the indexes it has checked and only hashes a file again when its
+size or modification time changes. A long-running server therefore pays for
+the hash once per file version, and each later request only costs a stat.
+
+    python sv_index.py build FILE...
+    python sv_index.py show FILE FIRST LAST [-f FORMATTER] [-O OPTIONS]
+
+Lines are numbered from 1 and FIRST..LAST is inclusive. The window is lexed
+from the raw file contents, so the lexer's stripnl/ensurenl/tabsize options
+do not apply.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+from collections import namedtuple
+
+from sv_lexer import SVLexer
+
+VERSION = 1
+SUFFIX = ".svidx"
+
+# A place where lexing can resume: the match that starts ``column``
+# characters into line ``line`` (numbered from 0), whose first byte is at
+# ``offset`` in the file, is made with the state stack ``stack``.
+Checkpoint = namedtuple("Checkpoint", "line offset column stack")
+
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class LineIndex:
+
+    def __init__(self, sha256, size, interval, line_count, checkpoints, encoding="utf-8"):
+        self.sha256 = sha256
+        self.size = size
+        self.interval = interval
+        self.line_count = line_count
+        self.checkpoints = checkpoints
+        self.encoding = encoding
+
+    @classmethod
+    def build(cls, path, interval=1000, lexer=None, encoding="utf-8"):
+        lexer = lexer or SVLexer()
+        with open(path, "rb") as f:
+            data = f.read()
+        # surrogateescape keeps a one to one mapping between undecodable
+        # bytes and characters, so byte offsets can be recomputed exactly.
+        text = data.decode(encoding, "surrogateescape")
+        checkpoints = []
+        # Line bookkeeping for the position most recently looked at.
+        cursor = {"line": 0, "start": 0, "byte": 0, "next": 0}
+
+        def mark(pos, statestack):
+            if pos < cursor["next"] or pos >= len(text):
+                return
+            # Advance to the line containing pos, counting bytes on the way.
+            line, start = cursor["line"], cursor["start"]
+            count = text.count("\n", start, pos)
+            if count:
+                new_start = text.rindex("\n", start, pos) + 1
+                cursor["byte"] += len(text[start:new_start].encode(encoding, "surrogateescape"))
+                line += count
+                start = new_start
+            cursor["line"], cursor["start"] = line, start
+            checkpoints.append(Checkpoint(line, cursor["byte"], pos - start, tuple(statestack)))
+            # The next checkpoint goes on the first line of the next interval.
+            target = (line // interval + 1) * interval
+            nxt = start
+            for _ in range(target - line):
+                nxt = text.find("\n", nxt) + 1
+                if nxt == 0:
+                    nxt = len(text)
+                    break
+            cursor["next"] = nxt
+
+        for _ in lexer.get_tokens_from(text, 0, ["root"], mark):
+            pass
+        line_count = text.count("\n") + (0 if text.endswith("\n") or not text else 1)
+        return cls(hashlib.sha256(data).hexdigest(), len(data), interval,
+                   line_count, checkpoints, encoding)
+
+    def to_json(self):
+        return {
+            "version": VERSION,
+            "sha256": self.sha256,
+            "size": self.size,
+            "interval": self.interval,
+            "line_count": self.line_count,
+            "encoding": self.encoding,
+            "checkpoints": [[c.line, c.offset, c.column, list(c.stack)]
+                            for c in self.checkpoints],
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        if data.get("version") != VERSION:
+            raise ValueError(f"unsupported index version {data.get('version')!r}")
+        checkpoints = [Checkpoint(line, offset, column, tuple(stack))
+                       for line, offset, column, stack in data["checkpoints"]]
+        return cls(data["sha256"], data["size"], data["interval"],
+                   data["line_count"], checkpoints, data["encoding"])
+
+    def save(self, path):
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.to_json(), f, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_json(json.load(f))
+
+    def matches(self, path, verify_hash=True):
+        # A size mismatch is caught without reading the file.
+        if os.path.getsize(path) != self.size:
+            return False
+        return not verify_hash or file_digest(path) == self.sha256
+
+    def checkpoint_before(self, line):
+        # The last checkpoint at or before the start of ``line`` (from 0).
+        best = None
+        for c in self.checkpoints:
+            if c.line < line or (c.line == line and c.column == 0):
+                best = c
+            else:
+                break
+        return best
+
+
+# Indexes already checked against their file's SHA-256, by real path, with
+# the (size, mtime_ns, interval) they were checked for. Hashing reads the
+# whole file, so it is only done again when the file's size or modification
+# time changes; otherwise a viewport request costs a stat.
+_verified = {}
+_VERIFIED_MAX = 256
+
+
+def open_index(path, interval=1000, lexer=None, verify_hash=True):
+    # Load the sidecar index of ``path``, building and saving it first if it
+    # is missing, unreadable or out of date.
+    real = os.path.realpath(path)
+    st = os.stat(real)
+    key = (st.st_size, st.st_mtime_ns, interval)
+    cached = _verified.get(real)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    index_path = path + SUFFIX
+    try:
+        index = LineIndex.load(index_path)
+    except (OSError, ValueError, KeyError, TypeError):
+        index = None
+    if index is None or index.interval != interval or not index.matches(path, verify_hash):
+        index = LineIndex.build(path, interval, lexer)
+        try:
+            index.save(index_path)
+        except OSError:
+            pass
+    elif not verify_hash:
+        return index
+    if real not in _verified and len(_verified) >= _VERIFIED_MAX:
+        del _verified[next(iter(_verified))]
+    _verified[real] = (key, index)
+    return index
+
+
+def _read_from(path, offset, stop, encoding):
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read() if stop is None else f.read(stop - offset)
+    return data.decode(encoding, "surrogateescape")
+
+
+def _window(lexer, text, column, stack, base_line, first, last, until=None):
+    # Lex ``text`` (which starts at line ``base_line``) from ``column`` and
+    # collect the tokens of lines first..last (from 0). If ``until`` is a
+    # checkpoint, also report whether lexing reached it exactly.
+    tokens = []
+    line = base_line
+    reached = until is None
+    target = None
+    if until is not None:
+        target = _line_start(text, until.line - base_line)
+        if target is not None:
+            target += until.column
+
+    def mark(pos, statestack):
+        nonlocal reached
+        if pos == target and tuple(statestack) == until.stack:
+            reached = True
+
+    for pos, ttype, value in lexer.get_tokens_from(text, column, list(stack), mark):
+        if line > last:
+            if reached or (target is not None and pos > target):
+                break
+            continue
+        # Split the token on newlines and keep the parts inside the window.
+        parts = value.split("\n")
+        for i, part in enumerate(parts):
+            if i:
+                if first <= line <= last:
+                    tokens.append((ttype, "\n"))
+                line += 1
+            if part and first <= line <= last:
+                tokens.append((ttype, part))
+    return tokens, reached
+
+
+def _line_start(text, lines):
+    pos = 0
+    for _ in range(lines):
+        pos = text.find("\n", pos) + 1
+        if pos == 0:
+            return None
+    return pos
+
+
+def highlight_lines(path, first, last, lexer=None, index=None, interval=1000):
+    # Return the (tokentype, value) pairs of lines ``first`` to ``last`` of
+    # ``path`` (numbered from 1, inclusive), as the lexer would have produced
+    # them when lexing the whole file.
+    lexer = lexer or SVLexer()
+    index = index or open_index(path, interval, lexer)
+    first, last = max(first, 1) - 1, last - 1
+    start = index.checkpoint_before(first)
+    if start is None:
+        start = Checkpoint(0, 0, 0, ("root",))
+    # Read up to the resume point after the one following the window: lexing
+    # the window never looks that far ahead in practice, and reaching the
+    # later resume point with the recorded state proves it did not.
+    later = [c for c in index.checkpoints if c.line > last]
+    if len(later) >= 2:
+        text = _read_from(path, start.offset, later[1].offset, index.encoding)
+        tokens, reached = _window(lexer, text, start.column, start.stack,
+                                  start.line, first, last, later[0])
+        if reached:
+            return tokens
+    text = _read_from(path, start.offset, None, index.encoding)
+    return _window(lexer, text, start.column, start.stack, start.line, first, last)[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="build or refresh sidecar indexes")
+    build.add_argument("files", nargs="+", metavar="FILE")
+    build.add_argument("--interval", type=int, default=1000)
+    show = sub.add_parser("show", help="highlight a range of lines")
+    show.add_argument("file", metavar="FILE")
+    show.add_argument("first", type=int, metavar="FIRST")
+    show.add_argument("last", type=int, metavar="LAST")
+    show.add_argument("--interval", type=int, default=1000)
+    show.add_argument("-f", dest="formatter", default="terminal256")
+    show.add_argument("-O", dest="options", default="",
+                      help="formatter options, e.g. style=sv-style-dark")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        for path in args.files:
+            index = open_index(path, args.interval)
+            print(f"{path}: {index.line_count} lines, {len(index.checkpoints)} checkpoints")
+        return 0
+
+    from pygments import format
+    from pygments.formatters import get_formatter_by_name
+
+    options = dict(o.split("=", 1) if "=" in o else (o, True)
+                   for o in args.options.split(",") if o)
+    formatter = get_formatter_by_name(args.formatter, **options)
+    tokens = highlight_lines(args.file, args.first, args.last, interval=args.interval)
+    out = sys.stdout.buffer if formatter.encoding else sys.stdout
+    format(tokens, formatter, out)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
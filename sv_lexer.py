@@ -1,7 +1,23 @@
 """An SV plugin lexer for Pygments."""
 
-from pygments.lexer import RegexLexer, bygroups
-from pygments.token import Token, Text, Whitespace
+import hashlib
+import re
+import threading
+from types import MappingProxyType
+
+from pygments.lexer import RegexLexer, RegexLexerMeta, bygroups as _bygroups
+from pygments.token import Token, Error, Text, Whitespace, _TokenType
+from pygments.util import get_bool_opt
+
+try:
+    import sv_accel
+except ImportError:
+    sv_accel = None
+
+try:
+    from sv_tuned import RULE_ORDER
+except ImportError:
+    RULE_ORDER = {}
 
 Comment = Token.Comment
 Constant = Token.Constant
@@ -135,7 +151,89 @@ SV_TYPES = {
     Support.Variable:                           'sv-suv',
 }
 
-class SVLexer(RegexLexer):
+def bygroups(*args):
+    # pygments.lexer.bygroups, remembering its actions so that get_spans can
+    # read the group spans off the match instead of calling the callback.
+    callback = _bygroups(*args)
+    if all(action is None or type(action) is _TokenType for action in args):
+        callback.actions = args
+    return callback
+
+def materialize(text, spans):
+    # Turn the (tokentype, start, end) spans of SVLexer.get_spans into the
+    # (tokentype, value) pairs the rest of Pygments works with.
+    for ttype, start, end in spans:
+        yield ttype, text[start:end]
+
+_dimension = re.compile(r'(\[)([a-zA-Z0-9_\-\+]*)(?:(:)([a-zA-Z0-9_\-\+]*))?(\])(\s*)')
+_dimension_actions = (Text, Constant.Numeric, Text, Constant.Numeric, Text, Whitespace)
+
+def _dimensions(text, pos, end):
+    while pos < end:
+        m = _dimension.match(text, pos, end)
+        for i, action in enumerate(_dimension_actions):
+            data = m.group(i + 1)
+            if data:
+                yield m.start(i + 1), action, data
+        pos = m.end()
+
+def _port_declaration(lexer, match):
+    # The port declaration rule repeats its [msb:lsb] groups and a repeated
+    # group only captures its last iteration, so the dimensions are split up
+    # here instead of with bygroups to keep every character in the output.
+    text = match.string
+    pos = match.start()
+    if match.group(1):
+        yield pos, Storage.Type.Interface, match.group(1)
+        pos = match.end(1)
+    yield from _dimensions(text, pos, match.start(4))
+    yield match.start(4), Storage, match.group(4)
+    yield from _dimensions(text, match.end(4), match.end())
+
+def rules_fingerprint(rules, flags):
+    # Identifies the regexes of a state's rules, in order. A rule order from
+    # sv_tuned is only valid for the regexes it was worked out for.
+    h = hashlib.sha256(str(flags).encode())
+    for rule in rules:
+        h.update(rule[0].encode() + b"\0")
+    return h.hexdigest()[:16]
+
+class SVLexerMeta(RegexLexerMeta):
+    # RegexLexerMeta compiles the token table on the first instantiation.
+    # Several threads can get there at the same time, so the compilation is
+    # done under a lock, and the result is frozen so that the table shared by
+    # every instance cannot be modified afterwards.
+    _lock = threading.Lock()
+
+    def __call__(cls, *args, **kwds):
+        if '_tokens' not in cls.__dict__:
+            with SVLexerMeta._lock:
+                if '_tokens' not in cls.__dict__:
+                    cls._all_tokens = {}
+                    cls._tmpname = 0
+                    tokendefs = cls.get_tokendefs()
+                    tokens = cls.process_tokendef('', tokendefs)
+                    cls._apply_rule_order(tokendefs, tokens)
+                    cls._tokens = MappingProxyType(
+                        {state: tuple(rules) for state, rules in tokens.items()})
+        return super().__call__(*args, **kwds)
+
+    def _apply_rule_order(cls, tokendefs, tokens):
+        # Try the rules of each state in the order given by cls.rule_order,
+        # skipping states whose rules changed since the order was made.
+        for state, (fingerprint, order) in cls.rule_order.items():
+            rules = tokendefs.get(state, ())
+            if (len(tokens.get(state, ())) != len(rules)
+                    or sorted(order) != list(range(len(rules)))
+                    or rules_fingerprint(rules, cls.flags) != fingerprint):
+                continue
+            tokens[state] = [tokens[state][i] for i in order]
+
+class SVLexer(RegexLexer, metaclass=SVLexerMeta):
+    # Instances hold no state between calls: the token table is shared and
+    # read-only, and every call to get_tokens keeps its state stack to
+    # itself. One instance can therefore be used from many threads at once,
+    # as long as its options and filters are not changed meanwhile.
     # This should be the human-readable name of the language.  In this example,
     # doing
     #
@@ -188,6 +286,11 @@ class SVLexer(RegexLexer):
     #
     # will return the SVLexer class.
     mimetypes = ["text/x-systemverilog"]
+
+    # The order in which the rules of each state are tried, as worked out by
+    # sv_tune.py ({} for the order the table is written in). TunedSVLexer
+    # uses the order generated into sv_tuned.py.
+    rule_order = {}
     
     functions = [
         (r'\b(\w+)(?=\s*\()', Support.Function.Generic),
@@ -200,7 +303,7 @@ class SVLexer(RegexLexer):
         (r'\b(\d[\d_]*)\b', Constant.Numeric.Decimal),
         (r'\b(\d+(fs|ps|ns|us|ms|s)?)\b', Constant.Numeric.Time),
         (r'\b([A-Z][A-Z0-9_]*)\b', Constant.Other.Net),
-        (r'(`ifdef|`ifndef|`default_nettype)(?:\s+)(\w+)', bygroups(Constant.Other.Preprocessor, Support.Variable)),
+        (r'(`ifdef|`ifndef|`default_nettype)(\s+)(\w+)', bygroups(Constant.Other.Preprocessor, Whitespace, Support.Variable)),
         (r'`(celldefine|else|elsif|endcelldefine|endif|include|line|nounconnected_drive|resetall|timescale|unconnected_drive|undef|begin_\w+|end_\w+|remove_\w+|restore_\w+)\b', Constant.Other.Preprocessor),
         (r'`\b([a-zA-Z_][a-zA-Z0-9_]*)\b', Constant.Other.Define),
         (r'\b(null)\b', Support.Constant),
@@ -220,7 +323,7 @@ class SVLexer(RegexLexer):
     ]
 
     portDir = [
-        (r'([a-zA-Z_][a-zA-Z0-9_]*\b\s+)?(?:(?:\[([a-zA-Z0-9_\-\+]*):([a-zA-Z0-9_\-\+]*)\]\s*)*([a-zA-Z_][a-zA-Z0-9_\s]*)(?:\[([a-zA-Z0-9_\-\+]*)(?::([a-zA-Z0-9_\-\+]*))?\]\s*)*)', bygroups(Storage.Type.Interface, Constant.Numeric, Constant.Numeric, Storage, Constant.Numeric, Constant.Numeric)),
+        (r'([a-zA-Z_][a-zA-Z0-9_]*\b\s+)?(?:(?:\[([a-zA-Z0-9_\-\+]*):([a-zA-Z0-9_\-\+]*)\]\s*)*([a-zA-Z_][a-zA-Z0-9_\s]*)(?:\[([a-zA-Z0-9_\-\+]*)(?::([a-zA-Z0-9_\-\+]*))?\]\s*)*)', _port_declaration),
         (r'\s*\b(output|input|inout|ref)\b', Support.Type),
         (r'([a-zA-Z_][a-zA-Z0-9_]*)(::)', bygroups(Support.Type.Scope, Keyword.Operator.Scope)),
         (r'\)', Text, '#pop'),
@@ -241,7 +344,7 @@ class SVLexer(RegexLexer):
     
     ifmodport = [
         # interface with modport declaration
-        (r'(\b[a-zA-Z_][a-zA-Z0-9_]*)(?:\.)([a-zA-Z_][a-zA-Z0-9_]*\s+)([a-zA-Z_][a-zA-Z0-9_]*\b)', bygroups(Storage.Type.Interface, Support.Modport)),
+        (r'(\b[a-zA-Z_][a-zA-Z0-9_]*)(\.)([a-zA-Z_][a-zA-Z0-9_]*\s+)([a-zA-Z_][a-zA-Z0-9_]*\b)', bygroups(Storage.Type.Interface, Text, Support.Modport, Text)),
     ]
 
     strings = [
@@ -260,12 +363,12 @@ class SVLexer(RegexLexer):
     ]
     
     moduleBinding = [
-        (r'(?:\.)([a-zA-Z_][a-zA-Z0-9_]*)(?:\s*\()', bygroups(Support.Function.Port), 'modulebinding'),
-        (r'(?:\.)([a-zA-Z_][a-zA-Z0-9_]*\s*)', bygroups(Support.Function.Port.Implicit))
+        (r'(\.)([a-zA-Z_][a-zA-Z0-9_]*)(\s*)(\()', bygroups(Text, Support.Function.Port, Whitespace, Text), 'modulebinding'),
+        (r'(\.)([a-zA-Z_][a-zA-Z0-9_]*\s*)', bygroups(Text, Support.Function.Port.Implicit))
     ]
     
     moduleParam = [
-        (r'(#)(?:\s*\()', bygroups(Keyword.Operator.Param), 'moduleparam'),
+        (r'(#)(\s*)(\()', bygroups(Keyword.Operator.Param, Whitespace, Text), 'moduleparam'),
     ]
 
     allTypes = storageType + storageModifier
@@ -275,7 +378,7 @@ class SVLexer(RegexLexer):
     ] + storageScope
     
     structAnonymous = [
-        (r'(?:\s*\b)(struct|union)(?:\s*)(packed)?(?:\s*)', bygroups(Keyword.Control, Keyword.Control), 'structanonymous')
+        (r'(\s*)\b(struct|union)(\s*)(packed)?(\s*)', bygroups(Whitespace, Keyword.Control, Whitespace, Keyword.Control, Whitespace), 'structanonymous')
     ] + baseGrammar
 
     # This lexer highlights lines that read "foo".
@@ -296,7 +399,7 @@ class SVLexer(RegexLexer):
             # sequence
             (r'(\bsequence\s+)([a-zA-Z_][a-zA-Z0-9_]*)', bygroups(Keyword.Control, Entity.Name.Function)),
             # bing directive
-            (r'(\bbind\s+)([a-zA-Z_][a-zA-Z0-9_\.]*\b)', bygroups(Keyword.Control)),
+            (r'(\bbind\s+)([a-zA-Z_][a-zA-Z0-9_\.]*\b)', bygroups(Keyword.Control, Text)),
             # labeled block
             (r'\b(begin|fork)(\s*:\s*)([a-zA-Z_][a-zA-Z0-9_]*\b)', bygroups(Keyword.Other.Block, Keyword.Operator, Entity.Name.Section)),
             # sva property
@@ -304,20 +407,20 @@ class SVLexer(RegexLexer):
             # sva assert
             (r'(\b\w+)(\s*:\s*)(assert\b)', bygroups(Entity.Name.Sva, Keyword.Operator, Keyword.Sva)),
             # psl one-liner
-            (r'(\s*//\s*)(psl\s+)(?:(\w+)\s*(:))?(?:\s*)(default|assert|assume)', bygroups(Comment.Line.DoubleSlash, Keyword.Psl, Entity.Psl.Name, Keyword.Operator, Keyword.Psl), 'psl'),
+            (r'(\s*//\s*)(psl\s+)(?:(\w+)(\s*)(:))?(\s*)(default|assert|assume)', bygroups(Comment.Line.DoubleSlash, Keyword.Psl, Entity.Psl.Name, Whitespace, Keyword.Operator, Whitespace, Keyword.Psl), 'psl'),
             # psl multiline
             (r'(\s*/\*\s*)(psl)', bygroups(Comment.Block, Keyword.Psl), 'pslmulti'),
             # inside operator
             (r'(inside\s+)({)', bygroups(Keyword.Control, Text), 'inside'),
             # keyword
-            (r'(?:\s*\b)(automatic|cell|config|deassign|defparam|design|disable|edge|endconfig|endgenerate|endspecify|endtable|event|generate|genvar|ifnone|incdir|instance|liblist|library|macromodule|negedge|noshowcancelled|posedge|pulsestyle_onevent|pulsestyle_ondetect|scalared|showcancelled|specify|specparam|table|use|vectored)(?:\b)', bygroups(Keyword.Other)),
-            (r'(?:\s*\b)(initial|always|wait|force|release|assign|always_comb|always_ff|always_latch|forever|repeat|while|for|if|iff|else|case|casex|casez|default|endcase|return|break|continue|do|foreach|with|inside|dist|clocking|cover|coverpoint|property|bins|binsof|illegal_bins|ignore_bins|randcase|modport|matches|solve|static|assert|assume|before|expect|cross|ref|first_match|srandom|struct|packed|final|chandle|alias|tagged|extern|throughout|timeprecision|timeunit|priority|type|union|uwire|wait_order|triggered|randsequence|import|export|context|pure|intersect|wildcard|within|new|typedef|enum|this|super|begin|fork|forkjoin|unique|unique0|priority)(?:\b)', bygroups(Keyword.Control)),
-            (r'(?:\s*\b)(end|endtask|endmodule|endfunction|endprimitive|endclass|endpackage|endsequence|endprogram|endclocking|endproperty|endgroup|endinterface|join|join_any|join_none)(?:\b)(?:(\s*)(:)(\s*)(\w+))?', bygroups(Keyword.Control, Whitespace, Keyword.Operator, Whitespace, Entity.Label)),
+            (r'(\s*)\b(automatic|cell|config|deassign|defparam|design|disable|edge|endconfig|endgenerate|endspecify|endtable|event|generate|genvar|ifnone|incdir|instance|liblist|library|macromodule|negedge|noshowcancelled|posedge|pulsestyle_onevent|pulsestyle_ondetect|scalared|showcancelled|specify|specparam|table|use|vectored)\b', bygroups(Whitespace, Keyword.Other)),
+            (r'(\s*)\b(initial|always|wait|force|release|assign|always_comb|always_ff|always_latch|forever|repeat|while|for|if|iff|else|case|casex|casez|default|endcase|return|break|continue|do|foreach|with|inside|dist|clocking|cover|coverpoint|property|bins|binsof|illegal_bins|ignore_bins|randcase|modport|matches|solve|static|assert|assume|before|expect|cross|ref|first_match|srandom|struct|packed|final|chandle|alias|tagged|extern|throughout|timeprecision|timeunit|priority|type|union|uwire|wait_order|triggered|randsequence|import|export|context|pure|intersect|wildcard|within|new|typedef|enum|this|super|begin|fork|forkjoin|unique|unique0|priority)\b', bygroups(Whitespace, Keyword.Control)),
+            (r'(\s*)\b(end|endtask|endmodule|endfunction|endprimitive|endclass|endpackage|endsequence|endprogram|endclocking|endproperty|endgroup|endinterface|join|join_any|join_none)\b(?:(\s*)(:)(\s*)(\w+))?', bygroups(Whitespace, Keyword.Control, Whitespace, Keyword.Operator, Whitespace, Entity.Label)),
             (r'\b(std)\b::', Support.Class),
             (r'(^\s*`define\s+)([a-zA-Z_][a-zA-Z0-9_]*)', bygroups(Constant.Other.Define, Entity.Name.Type.Define))
         ] + comments + [
-            (r'(?:\s*)(primitive|package|constraint|interface|covergroup|program)(\s+\b[a-zA-Z_][a-zA-Z0-9_]*\b)', bygroups(Keyword.Control, Entity.Name.Type.Class)),
-            (r'(?:([a-zA-Z_][a-zA-Z0-9_]*)\s*(:))?(?:\s*)(coverpoint|cross)(\s+[a-zA-Z_][a-zA-Z0-9_]*)', bygroups(Entity.Name.Type.Class, Keyword.Operator.Other, Keyword.Control)),
+            (r'(\s*)(primitive|package|constraint|interface|covergroup|program)(\s+\b[a-zA-Z_][a-zA-Z0-9_]*\b)', bygroups(Whitespace, Keyword.Control, Entity.Name.Type.Class)),
+            (r'(?:([a-zA-Z_][a-zA-Z0-9_]*)(\s*)(:))?(\s*)(coverpoint|cross)(\s+[a-zA-Z_][a-zA-Z0-9_]*)', bygroups(Entity.Name.Type.Class, Whitespace, Keyword.Operator.Other, Whitespace, Keyword.Control, Text)),
             (r'(?:\b)(virtual\s+)?(class\s+)(\b[a-zA-Z_][a-zA-Z0-9_]*\b)', bygroups(Keyword.Control, Keyword.Control, Entity.Name.Type.Class)),
             (r'(\bextends\s+)([a-zA-Z_][a-zA-Z0-9_]*\b)', bygroups(Keyword.Control, Entity.Other.InheritedClass))
         ] + allTypes + operators + [
@@ -327,18 +430,18 @@ class SVLexer(RegexLexer):
             # cast operator
             (r"(\b[a-zA-Z_][a-zA-Z0-9_]*)(')(?=\()", bygroups(Storage.Type, Keyword.Operator.Cast)),
             # parameter/localparameter with no type in uppercase
-            (r'(?:^\s*)(localparam|parameter)(\s+[A-Z_][A-Z0-9_]*\b\s*)(?=(=))', bygroups(Keyword.Other, Constant.Other)),
+            (r'^(\s*)(localparam|parameter)(\s+[A-Z_][A-Z0-9_]*\b\s*)(?=(=))', bygroups(Whitespace, Keyword.Other, Constant.Other)),
             # parameter/localparameter with no type
-            (r'(?:^\s*)(localparam|parameter)(\s+[a-zA-Z_][a-zA-Z0-9_]*\b\s*)(?=(=))', bygroups(Keyword.Other)),
+            (r'^(\s*)(localparam|parameter)(\s+[a-zA-Z_][a-zA-Z0-9_]*\b\s*)(?=(=))', bygroups(Whitespace, Keyword.Other, Text)),
             # variable/parameter/localparameter with user-defined type
-            (r"(?:^\s*)(local\s+|protected\s+|localparam\s+|parameter\s+)?(const\s+|virtual\s+)?(rand\s+|randc\s+)?(?:([a-zA-Z_][a-zA-Z0-9_]*)(::))?([a-zA-Z_][a-zA-Z0-9_]*\b\s*)(?=(#\s*\([\w,]+\)\s*)?([a-zA-Z][a-zA-Z0-9_\s\[\]']*)(;|,|=|'\{))", bygroups(Keyword.Other, Keyword.Other, Storage.Type.Rand, Support.Type.Scope, Keyword.Operator.Scope, Storage.Type.Userdefined)),
-            (r'(\s*\boption)(?:\.)', bygroups(Keyword.Cover)),
-            (r'(?:\s*\b)(local|const|protected|virtual|localparam|parameter)(?:\b)', bygroups(Keyword.Other)),
+            (r"^(\s*)(local\s+|protected\s+|localparam\s+|parameter\s+)?(const\s+|virtual\s+)?(rand\s+|randc\s+)?(?:([a-zA-Z_][a-zA-Z0-9_]*)(::))?([a-zA-Z_][a-zA-Z0-9_]*\b\s*)(?=(#\s*\([\w,]+\)\s*)?([a-zA-Z][a-zA-Z0-9_\s\[\]']*)(;|,|=|'\{))", bygroups(Whitespace, Keyword.Other, Keyword.Other, Storage.Type.Rand, Support.Type.Scope, Keyword.Operator.Scope, Storage.Type.Userdefined)),
+            (r'(\s*\boption)(\.)', bygroups(Keyword.Cover, Text)),
+            (r'(\s*)\b(local|const|protected|virtual|localparam|parameter)\b', bygroups(Whitespace, Keyword.Other)),
             (r'(?:\s*\b)(rand|randc)(?:\b)', Storage.Type.Rand),
             # module instantiation with parameter
-            (r'(?:^)(?:\s*(bind)\s+([a-zA-Z_][\w\.]*))?(\s*[a-zA-Z_][a-zA-Z0-9_]*\s*)(?=#[^#])', bygroups(Keyword.Control, None, Storage.Module), 'moduleinstparam'),
+            (r'^(?:(\s*)(bind)(\s+)([a-zA-Z_][\w\.]*))?(\s*[a-zA-Z_][a-zA-Z0-9_]*\s*)(?=#[^#])', bygroups(Whitespace, Keyword.Control, Whitespace, Text, Storage.Module), 'moduleinstparam'),
             # module instantiation with no param
-            (r'(\b[a-zA-Z_][a-zA-Z0-9_]*\s+)(?!intersect|and|or|throughout|within)([a-zA-Z_][a-zA-Z0-9_]*\s*)(?:\[(\d+)(?:\:(\d+))?\])?\s*(\(|$)', bygroups(Storage.Module, Entity.Name.Type.Module, Constant.Numeric, Constant.Numeric), 'moduleinstnoparam'),
+            (r'(\b[a-zA-Z_][a-zA-Z0-9_]*\s+)(?!intersect|and|or|throughout|within)([a-zA-Z_][a-zA-Z0-9_]*\s*)(?:(\[)(\d+)(?:(\:)(\d+))?(\]))?(\s*)(\(|$)', bygroups(Storage.Module, Entity.Name.Type.Module, Text, Constant.Numeric, Text, Constant.Numeric, Text, Whitespace, Text), 'moduleinstnoparam'),
             # struct assignement (could also match array assignment)
             (r"(\b\s+&lt;?=\s*)(\'{)", bygroups(Keyword.Operator.Other, Keyword.Operator.Other, Keyword.Operator.Other), 'structassign')
         ] + storageScope + functions + constants,
@@ -349,11 +452,11 @@ class SVLexer(RegexLexer):
         ] + baseGrammar,
         'portlist': portDir,
         'struct': [
-            (r'(}\s*)([a-zA-Z_][a-zA-Z0-9_]*)(?:\s*;)', bygroups(Keyword.Operator.Other, Entity.Name.Function), '#pop'),
+            (r'(}\s*)([a-zA-Z_][a-zA-Z0-9_]*)(\s*)(;)', bygroups(Keyword.Operator.Other, Entity.Name.Function, Whitespace, Text), '#pop'),
         ] + structAnonymous + baseGrammar,
         'typedef': [
             (r'([a-zA-Z_][a-zA-Z0-9_]*\s*)(?=(\[[a-zA-Z0-9_:\$\-\+]*\])?;)', bygroups(Entity.Name.Function), '#pop'),
-            (r'(\b[a-zA-Z_]\w*\s*)(#)\(', bygroups(Storage.Type.Userdefined, Keyword.Operator.Param))
+            (r'(\b[a-zA-Z_]\w*\s*)(#)(\()', bygroups(Storage.Type.Userdefined, Keyword.Operator.Param, Text))
         ] + baseGrammar + moduleBinding,
         'module': [
             (r';', Text, '#pop'),
@@ -367,7 +470,7 @@ class SVLexer(RegexLexer):
         ] + operators + functions + constants,
         'pslmulti': [
             (r'(\*/)', bygroups(Comment.Block), '#pop'),
-            (r'(?:^\s*)(?:(\w+)\s*(:))?(?:\s*)(default|assert|assume)', bygroups(Entity.Psl.Name, Keyword.Operator, Keyword.Psl)),
+            (r'^(\s*)(?:(\w+)(\s*)(:))?(\s*)(default|assert|assume)', bygroups(Whitespace, Entity.Psl.Name, Whitespace, Keyword.Operator, Whitespace, Keyword.Psl)),
             (r'(\bproperty\s+)(\w+)', bygroups(Keyword.Psl, Entity.Psl.Name)),
             (r'\b(never|always|default|clock|within|rose|fell|stable|until|before|next|eventually|abort|posedge|negedge)\b', Keyword.Psl),
         ] + operators + functions + constants,
@@ -405,7 +508,7 @@ class SVLexer(RegexLexer):
             (r'\b(virtual)\b', Keyword.Control)
         ],
         'structanonymous': [
-            (r'(})(\s*[a-zA-Z_]\w*)(?:\s*;)', bygroups(Keyword.Operator.Other), '#pop'),
+            (r'(})(\s*[a-zA-Z_]\w*)(\s*)(;)', bygroups(Keyword.Operator.Other, Text, Whitespace, Text), '#pop'),
         ],
         'inside': [
             (r'}', Text, '#pop'),
@@ -414,3 +517,176 @@ class SVLexer(RegexLexer):
             (r',', Text),
         ] + baseGrammar,
     }
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        # Use the scanners from sv_accel for the hot rules. They only pay off
+        # once sv_accel has been compiled, so that is the default.
+        self.accelerate = get_bool_opt(
+            options, "accelerate", sv_accel is not None and sv_accel.COMPILED)
+
+    def get_tokens_unprocessed(self, text, stack=('root',)):
+        if not self.accelerate:
+            return RegexLexer.get_tokens_unprocessed(self, text, stack)
+        return self.get_tokens_from(text, 0, list(stack))
+
+    def get_tokens_from(self, text, pos=0, statestack=None, mark=None):
+        # Lex ``text`` starting at ``pos`` with the state stack ``statestack``
+        # (a list, updated in place), yielding (index, tokentype, value). See
+        # get_spans for ``mark``.
+        for ttype, start, end in self.get_spans(text, pos, statestack, mark):
+            yield start, ttype, text[start:end]
+
+    def get_spans(self, text, pos=0, statestack=None, mark=None):
+        # Like get_tokens_from, but yield (tokentype, start, end) spans into
+        # ``text`` instead of copying each value out of it. Use materialize()
+        # to turn spans into (tokentype, value) pairs when they are needed.
+        #
+        # ``mark(pos, statestack)`` is called, if given, each time a new match
+        # is about to be made at ``pos``. Lexing again from that position with
+        # a copy of that stack gives the same tokens, which is what the line
+        # index and the diff highlighter rely on to resume in the middle of a
+        # file.
+        #
+        # This is RegexLexer.get_tokens_unprocessed, except that the root,
+        # comment and string states first ask sv_accel whether the next token
+        # is one it can scan. The scanners reproduce the rules exactly, so the
+        # output is identical with or without them.
+        if statestack is None:
+            statestack = ['root']
+        accelerate = self.accelerate
+        if accelerate:
+            scan_root = sv_accel.scan_root
+        length = len(text)
+        tokendefs = self._tokens
+        statetokens = tokendefs[statestack[-1]]
+        while 1:
+            if mark is not None:
+                mark(pos, statestack)
+            if accelerate and pos < length:
+                state = statestack[-1]
+                if state == 'root':
+                    kind, end = scan_root(text, pos)
+                    if kind == sv_accel.WHITESPACE:
+                        yield Whitespace, pos, end
+                        pos = end
+                        continue
+                    if kind == sv_accel.ERROR_RUN:
+                        for i in range(pos, end):
+                            yield Error, i, i + 1
+                        pos = end
+                        continue
+                    if kind == sv_accel.LINE_COMMENT:
+                        yield Punctuation.Definition.Comment, pos, pos + 2
+                        if end > pos + 2:
+                            yield Comment.Line.DoubleSlash, pos + 2, end
+                        pos = end
+                        continue
+                    if kind == sv_accel.BLOCK_COMMENT:
+                        yield Punctuation.Definition.Comment, pos, pos + 2
+                        pos = end
+                        statestack.append('comment')
+                        statetokens = tokendefs['comment']
+                        continue
+                    if kind == sv_accel.STRING:
+                        yield Punctuation.Definition.String.Begin, pos, pos + 1
+                        pos = end
+                        statestack.append('string')
+                        statetokens = tokendefs['string']
+                        continue
+                    if kind != sv_accel.NOMATCH:
+                        yield _accel_numbers[kind], pos, end
+                        pos = end
+                        continue
+                elif state == 'string':
+                    if text[pos] == '"':
+                        yield Punctuation.Definition.String.End, pos, pos + 1
+                        pos += 1
+                        if len(statestack) > 1:
+                            statestack.pop()
+                        statetokens = tokendefs[statestack[-1]]
+                    else:
+                        end = sv_accel.scan_string(text, pos)
+                        yield String.Quoted.Double, pos, end
+                        pos = end
+                    continue
+                elif state == 'comment':
+                    if text.startswith('*/', pos):
+                        yield Comment.Block, pos, pos + 2
+                        pos += 2
+                        if len(statestack) > 1:
+                            statestack.pop()
+                        statetokens = tokendefs[statestack[-1]]
+                        continue
+                    end = sv_accel.scan_block_comment(text, pos)
+                    if end > pos:
+                        yield Comment.Block, pos, end
+                        pos = end
+                        continue
+            for rexmatch, action, new_state in statetokens:
+                m = rexmatch(text, pos)
+                if m:
+                    if action is not None:
+                        if type(action) is _TokenType:
+                            yield action, pos, m.end()
+                        else:
+                            actions = getattr(action, 'actions', None)
+                            if actions is None:
+                                for start, ttype, value in action(self, m):
+                                    yield ttype, start, start + len(value)
+                            else:
+                                for i, ttype in enumerate(actions, 1):
+                                    if ttype is not None:
+                                        start, end = m.span(i)
+                                        if end > start:
+                                            yield ttype, start, end
+                    pos = m.end()
+                    if new_state is not None:
+                        if isinstance(new_state, tuple):
+                            for state in new_state:
+                                if state == '#pop':
+                                    if len(statestack) > 1:
+                                        statestack.pop()
+                                elif state == '#push':
+                                    statestack.append(statestack[-1])
+                                else:
+                                    statestack.append(state)
+                        elif isinstance(new_state, int):
+                            if abs(new_state) >= len(statestack):
+                                del statestack[1:]
+                            else:
+                                del statestack[new_state:]
+                        elif new_state == '#push':
+                            statestack.append(statestack[-1])
+                        statetokens = tokendefs[statestack[-1]]
+                    break
+            else:
+                try:
+                    if text[pos] == '\n':
+                        # at EOL, reset state to "root"
+                        yield Whitespace, pos, pos + 1
+                        statestack[:] = ['root']
+                        statetokens = tokendefs['root']
+                        pos += 1
+                        continue
+                    yield Error, pos, pos + 1
+                    pos += 1
+                except IndexError:
+                    break
+
+class TunedSVLexer(SVLexer):
+    # SVLexer with the rules tried in the order sv_tune.py wrote to
+    # sv_tuned.py for a corpus of your own, or in table order when there is
+    # no sv_tuned.py. The tokens are the same either way; whether the order
+    # is any faster depends on the code it is tuned on, which sv_tune.py
+    # measures.
+    rule_order = RULE_ORDER
+
+if sv_accel is not None:
+    _accel_numbers = {
+        sv_accel.NUMBER: Constant.Numeric,
+        sv_accel.BIT: Constant.Numeric.Bit,
+        sv_accel.EXP: Constant.Numeric.Exp,
+        sv_accel.DECIMAL: Constant.Numeric.Decimal,
+        sv_accel.TIME: Constant.Numeric.Time,
+    }
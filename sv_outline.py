@@ -0,0 +1,327 @@
+"""Outline tree and folding ranges of an SV file, from its tokens.
+
+The keyword tokens SVLexer already produces are enough to recover the block
+structure: ``module``/``endmodule``, ``class``/``endclass``, functions,
+tasks, covergroups and the other named scopes, ``begin``/``end`` and
+``fork``/``join`` (with their labels), ``generate`` and ``case``. An Outliner
+follows those tokens as they go by, so an editor that highlights a file can
+get its outline from the same pass:
+
+    outliner = Outliner(text)
+    for pos, ttype, value in outliner.tee(lexer.get_tokens_unprocessed(text)):
+        ...
+    roots, folds = outliner.close()
+
+Lines are numbered from 0, as in LSP folding ranges.
+
+    python sv_outline.py FILE [--json]
+    python sv_outline.py --check
+"""
+
+import argparse
+import json
+import sys
+from collections import namedtuple
+
+from pygments.token import Token
+
+from sv_lexer import SVLexer
+
+FoldingRange = namedtuple("FoldingRange", "start_line end_line kind")
+
+Keyword = Token.Keyword
+EntityName = Token.Entity.Name
+CommentStart = Token.Punctuation.Definition.Comment
+
+# Keywords that open a block, and the kind of block they open.
+OPENERS = {
+    "module": "module", "macromodule": "module", "interface": "interface",
+    "package": "package", "program": "program", "class": "class",
+    "function": "function", "task": "task", "covergroup": "covergroup",
+    "property": "property", "sequence": "sequence", "begin": "begin",
+    "fork": "fork", "generate": "generate", "case": "case", "casex": "case",
+    "casez": "case", "randcase": "case",
+}
+
+# Keywords that close a block, and the kind of block they close.
+CLOSERS = {
+    "endmodule": "module", "endinterface": "interface", "endpackage": "package",
+    "endprogram": "program", "endclass": "class", "endfunction": "function",
+    "endtask": "task", "endgroup": "covergroup", "endproperty": "property",
+    "endsequence": "sequence", "end": "begin", "join": "fork",
+    "join_any": "fork", "join_none": "fork", "endgenerate": "generate",
+    "endcase": "case",
+}
+
+# Blocks that always appear in the outline; begin and fork blocks only do
+# when they are labeled.
+OUTLINE_KINDS = {"module", "interface", "package", "program", "class",
+                 "function", "task", "covergroup", "property", "sequence"}
+
+# Keywords after which an opener does not open a block: ``wait fork``,
+# ``virtual interface`` variables, ``assert property (...)`` and so on.
+NOT_BLOCK = {
+    "fork": {"wait", "disable"},
+    "interface": {"virtual"},
+    "property": {"assert", "assume", "cover", "restrict", "expect"},
+    "sequence": {"cover"},
+}
+
+# Keywords after which a function, task or class has no body: prototypes,
+# DPI imports and forward declarations.
+PROTOTYPE = {"extern", "pure", "import", "export", "typedef"}
+
+
+def _category(ttype):
+    for category in (Keyword, EntityName, CommentStart):
+        if ttype in category:
+            return category
+    return False
+
+
+# Token type -> _category(), filled in as types are seen.
+_categories = {}
+
+
+class OutlineNode:
+
+    def __init__(self, kind, name, start_line, end_line=None):
+        self.kind = kind
+        self.name = name
+        self.start_line = start_line
+        # None when the block is never closed.
+        self.end_line = end_line
+        self.children = []
+
+    def __repr__(self):
+        return f"OutlineNode({self.kind!r}, {self.name!r}, {self.start_line}, {self.end_line})"
+
+    def to_json(self):
+        return {
+            "kind": self.kind,
+            "name": self.name,
+            "start_line": self.start_line,
+            "end_line": self.end_line,
+            "children": [child.to_json() for child in self.children],
+        }
+
+
+class Outliner:
+
+    def __init__(self, text):
+        self.text = text
+        self.roots = []
+        self.folds = []
+        self._stack = []
+        # Line bookkeeping for the position most recently looked at.
+        self._pos = 0
+        self._line = 0
+        # The node waiting for its name, if any.
+        self._naming = None
+        # Set from a prototype keyword to the end of the statement.
+        self._prototype = False
+        self._previous = None
+        # First and last line of the current run of // comments.
+        self._comments = None
+        # End of the current /* */ comment. SVLexer goes back to the root
+        # state at each newline, so the lines inside a block comment come
+        # out as code; their tokens are ignored.
+        self._comment_end = 0
+
+    def _line_at(self, pos):
+        self._line += self.text.count("\n", self._pos, pos)
+        self._pos = pos
+        return self._line
+
+    def tee(self, tokens):
+        # Pass (pos, tokentype, value) tokens through, following them.
+        feed = self.feed
+        for token in tokens:
+            feed(token[1], token[0], token[0] + len(token[2]))
+            yield token
+
+    def feed(self, ttype, start, end):
+        # Follow one token, given as a span of the text.
+        if start < self._comment_end:
+            return
+        category = _categories.get(ttype)
+        if category is None:
+            category = _categories.setdefault(ttype, _category(ttype))
+        if not category and self._naming is None and not self._prototype:
+            return
+        if category is Keyword:
+            self._keyword(self.text[start:end].strip(), start)
+        elif category is EntityName:
+            if self._naming is not None:
+                name = self.text[start:end].strip()
+                if self._naming.kind == "interface" and name == "class":
+                    self._naming.kind = "class"
+                else:
+                    self._naming.name = name
+                    self._naming = None
+        elif category is CommentStart:
+            self._comment(start, end)
+        elif self._naming is not None and self._naming.kind in ("begin", "fork"):
+            # A label has to follow straight after the keyword.
+            if self.text[start:end].strip():
+                self._naming = None
+        if self._prototype or self._naming is not None:
+            if ";" in self.text[start:end]:
+                self._prototype = False
+                self._naming = None
+
+    def _keyword(self, word, pos):
+        previous, self._previous = self._previous, word
+        if self._naming is not None and self._naming.kind in ("begin", "fork"):
+            if word == ":":
+                return
+            self._naming = None
+        if word in PROTOTYPE or word.startswith("typedef "):
+            self._prototype = True
+            return
+        kind = OPENERS.get(word)
+        if kind is not None:
+            if previous in NOT_BLOCK.get(kind, ()):
+                return
+            if self._prototype and kind in ("function", "task", "class"):
+                return
+            node = OutlineNode(kind, None, self._line_at(pos))
+            self._stack.append(node)
+            self._naming = node
+            return
+        kind = CLOSERS.get(word)
+        if kind is None:
+            return
+        self._naming = None
+        for i in range(len(self._stack) - 1, -1, -1):
+            if self._stack[i].kind == kind:
+                line = self._line_at(pos)
+                while len(self._stack) > i + 1:
+                    self._pop(None)
+                self._pop(line)
+                return
+
+    def _pop(self, end_line):
+        node = self._stack.pop()
+        node.end_line = end_line
+        if end_line is not None and end_line > node.start_line:
+            self.folds.append(FoldingRange(node.start_line, end_line, "region"))
+        siblings = self._stack[-1].children if self._stack else self.roots
+        if node.kind in OUTLINE_KINDS or node.name is not None:
+            siblings.append(node)
+        else:
+            # Unlabeled blocks are left out; what they contain is not.
+            siblings.extend(node.children)
+
+    def _comment(self, start, end):
+        if self.text.startswith("/*", start):
+            close = self.text.find("*/", start + 2)
+            if close == -1:
+                self._comment_end = len(self.text)
+                return
+            self._comment_end = close + 2
+            lines = self.text.count("\n", start, close)
+            if lines:
+                first = self._line_at(start)
+                self.folds.append(FoldingRange(first, first + lines, "comment"))
+            return
+        line = self._line_at(start)
+        if self._comments is not None and self._comments[1] == line - 1:
+            self._comments[1] = line
+            return
+        self._flush_comments()
+        self._comments = [line, line]
+
+    def _flush_comments(self):
+        if self._comments is not None and self._comments[1] > self._comments[0]:
+            self.folds.append(FoldingRange(self._comments[0], self._comments[1], "comment"))
+        self._comments = None
+
+    def close(self):
+        # Return (roots, folds): the top-level outline nodes and the folding
+        # ranges sorted by first line. Blocks still open are closed with an
+        # end_line of None.
+        while self._stack:
+            self._pop(None)
+        self._flush_comments()
+        self.folds.sort()
+        return self.roots, self.folds
+
+
+def outline(text, lexer=None):
+    # Lex ``text`` and return its (roots, folds).
+    lexer = lexer or SVLexer()
+    text = lexer._preprocess_lexer_input(text)
+    outliner = Outliner(text)
+    feed = outliner.feed
+    for ttype, start, end in lexer.get_spans(text):
+        feed(ttype, start, end)
+    return outliner.close()
+
+
+# Sources with the outline they must give, as (kind, name, start_line,
+# end_line, children) tuples, for --check.
+CHECKS = [
+    # Block keywords in a doc comment are not blocks.
+    ("/*\n"
+     " * This module implements the arbiter. The function of each\n"
+     " * task is described below\n"
+     " */\n"
+     "module top (input clk);\n"
+     "  task run; endtask\n"
+     "endmodule\n",
+     [("module", "top", 4, 6, [("task", "run", 5, 5, [])])]),
+    # Nor is commented-out code, or a comment that is never closed.
+    ("/* module old;\nendmodule */\nmodule m;\nendmodule\n/*\nclass c;\n",
+     [("module", "m", 2, 3, [])]),
+    ("class c;\n  function void f(); endfunction\n  begin : b end\nendclass\n",
+     [("class", "c", 0, 3, [("function", "f", 1, 1, []), ("begin", "b", 2, 2, [])])]),
+]
+
+
+def _summary(nodes):
+    return [(node.kind, node.name, node.start_line, node.end_line, _summary(node.children))
+            for node in nodes]
+
+
+def check():
+    # Return the CHECKS sources whose outline is not the expected one.
+    return [source for source, expected in CHECKS if _summary(outline(source)[0]) != expected]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("file", metavar="FILE", nargs="?")
+    parser.add_argument("--json", action="store_true",
+                        help="print the outline and folding ranges as JSON")
+    parser.add_argument("--check", action="store_true",
+                        help="check the outline of a few known sources")
+    args = parser.parse_args(argv)
+    if args.check:
+        failing = check()
+        for source in failing:
+            print(f"wrong outline for {source!r}", file=sys.stderr)
+        return 1 if failing else 0
+    if args.file is None:
+        parser.error("FILE is required")
+
+    with open(args.file, encoding="utf-8", errors="replace") as f:
+        roots, folds = outline(f.read())
+    if args.json:
+        json.dump({"outline": [node.to_json() for node in roots],
+                   "folds": [fold._asdict() for fold in folds]}, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+        return 0
+
+    def show(nodes, depth):
+        for node in nodes:
+            end = "?" if node.end_line is None else node.end_line + 1
+            print(f"{'  ' * depth}{node.kind} {node.name or ''}  {node.start_line + 1}-{end}")
+            show(node.children, depth + 1)
+
+    show(roots, 0)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,434 @@
+"""Compact binary format for SV token streams.
+
+Meant for caching lexed files and for handing tokens between processes,
+where pickling (tokentype, value) pairs is slow, large, and gives back token
+types that are copies of the real ones. A stream is
+
+    magic "SVTS", version, CRC-32 of the type table
+    chunk*
+    end chunk (0 tokens)
+
+and every chunk holds a run of tokens:
+
+    varint token count
+    varint count of new types, then the name of each (varint size, ASCII)
+    id width (1 or 2)
+    varint size of the lengths, varint size of the text
+    type ids: one little-endian integer of the id width per token
+    lengths: one varint per token, in characters
+    text: the UTF-8 text of the chunk's tokens, once
+
+Type ids index TYPES, the SV_TYPES entries followed by the few standard
+types SVLexer also emits. Any other type is listed by name in the chunk it
+first appears in, and gets the next free id for the rest of the stream.
+The fixed-width ids and the lengths are decoded in bulk rather than token
+by token.
+
+Chunks can be written and read one at a time from files (StreamWriter,
+iter_tokens), or read straight out of a bytes-like object (bytes, mmap) with
+iter_chunks(), which only decodes the text of each chunk and hands back
+(tokentype, start, end) spans into it, for formatters with format_spans.
+
+    python sv_stream.py [--repeat N] PATH...
+
+compares the format with pickle on a corpus.
+"""
+
+import argparse
+import codecs
+import pickle
+import re
+import sys
+import time
+import zlib
+from array import array
+from io import BytesIO
+from itertools import accumulate
+
+from pygments.token import Error, Text, Token, Whitespace, string_to_tokentype
+
+from sv_lexer import SV_TYPES, SVLexer
+
+MAGIC = b"SVTS"
+VERSION = 1
+
+# Part of the format: changing this table needs a new VERSION. The CRC in
+# the header catches streams written with a different table anyway.
+TYPES = (None,) + tuple(SV_TYPES) + (Token, Text, Whitespace, Error)
+TABLE_CRC = zlib.crc32("\n".join(str(t) for t in TYPES[1:]).encode())
+
+_utf8_decode = codecs.utf_8_decode
+
+
+def _varint(n):
+    out = bytearray()
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def _read_varint(buf, i):
+    # Return the varint at buf[i] and the index after it.
+    b = buf[i]
+    if b < 0x80:
+        return b, i + 1
+    result = b & 0x7F
+    shift = 7
+    while True:
+        i += 1
+        b = buf[i]
+        result |= (b & 0x7F) << shift
+        if b < 0x80:
+            return result, i + 1
+        shift += 7
+
+
+def _header():
+    return MAGIC + bytes([VERSION]) + TABLE_CRC.to_bytes(4, "little")
+
+
+def _check_header(header):
+    if len(header) != 9 or header[:4] != MAGIC:
+        raise ValueError("not an SV token stream")
+    if header[4] != VERSION:
+        raise ValueError(f"unsupported token stream version {header[4]}")
+    if int.from_bytes(header[5:9], "little") != TABLE_CRC:
+        raise ValueError("token stream was written with a different type table")
+
+
+class StreamWriter:
+
+    def __init__(self, outfile, chunk_tokens=4096):
+        self.outfile = outfile
+        self.chunk_tokens = chunk_tokens
+        # Type -> id, starting from TYPES and growing as other types are seen.
+        self._ids = {t: i for i, t in enumerate(TYPES) if i}
+        self._new_types = []
+        self._types = []
+        self._lengths = bytearray()
+        self._text = []
+        outfile.write(_header())
+
+    def _type_id(self, ttype):
+        # Give a new type the next id; its name goes out with the chunk.
+        type_id = self._ids[ttype] = len(self._ids) + 1
+        self._new_types.append(str(ttype)[len("Token."):].encode())
+        return type_id
+
+    def write(self, ttype, value):
+        type_id = self._ids.get(ttype)
+        if type_id is None:
+            type_id = self._type_id(ttype)
+        self._types.append(type_id)
+        n = len(value)
+        if n < 0x80:
+            self._lengths.append(n)
+        else:
+            self._lengths += _varint(n)
+        self._text.append(value)
+        if len(self._types) >= self.chunk_tokens:
+            self.flush()
+
+    def write_tokens(self, tokens):
+        for ttype, value in tokens:
+            self.write(ttype, value)
+
+    def write_spans(self, text, spans):
+        # Write (tokentype, start, end) spans over ``text``. The text of each
+        # chunk is sliced out once instead of once per token.
+        ids = self._ids
+        types = self._types
+        lengths = self._lengths
+        chunk_tokens = self.chunk_tokens
+        chunk_start = None
+        for ttype, start, end in spans:
+            if chunk_start is None:
+                chunk_start = start
+            type_id = ids.get(ttype)
+            if type_id is None:
+                type_id = self._type_id(ttype)
+            types.append(type_id)
+            n = end - start
+            if n < 0x80:
+                lengths.append(n)
+            else:
+                lengths += _varint(n)
+            if len(types) >= chunk_tokens:
+                self._text.append(text[chunk_start:end])
+                chunk_start = None
+                self.flush()
+                types = self._types
+                lengths = self._lengths
+        if chunk_start is not None:
+            self._text.append(text[chunk_start:end])
+
+    def flush(self):
+        # Write out the tokens collected so far as one chunk.
+        if not self._types:
+            return
+        if len(self._ids) < 0x100:
+            width, ids = 1, bytes(self._types)
+        else:
+            width, ids = 2, _to_little_endian(array("H", self._types)).tobytes()
+        data = "".join(self._text).encode("utf-8", "surrogatepass")
+        header = bytearray(_varint(len(self._types)))
+        header += _varint(len(self._new_types))
+        for name in self._new_types:
+            header += _varint(len(name)) + name
+        header.append(width)
+        header += _varint(len(self._lengths)) + _varint(len(data))
+        write = self.outfile.write
+        write(header)
+        write(ids)
+        write(self._lengths)
+        write(data)
+        self._new_types = []
+        self._types = []
+        self._lengths = bytearray()
+        self._text = []
+
+    def close(self):
+        # Flush and write the end of the stream; the file is left open.
+        self.flush()
+        self.outfile.write(b"\x00")
+
+
+def _to_little_endian(ids):
+    if sys.byteorder == "big":
+        ids.byteswap()
+    return ids
+
+
+# A varint of more than one byte.
+_LONG_VARINT = re.compile(rb"[\x80-\xff]+[\x00-\x7f]")
+
+
+def _lengths(block):
+    # Decode a block of varints. Lengths under 128 take one byte, which is
+    # almost all of them, so the block is copied over in runs of those.
+    if block.isascii():
+        return block
+    lengths = []
+    pos = 0
+    for m in _LONG_VARINT.finditer(block):
+        lengths += block[pos:m.start()]
+        lengths.append(_read_varint(m.group(), 0)[0])
+        pos = m.end()
+    lengths += block[pos:]
+    return lengths
+
+
+class _Decoder:
+
+    def __init__(self):
+        self.types = list(TYPES)
+        # Every valid one-byte type id.
+        self._known = bytes(range(1, len(TYPES)))
+
+    def header(self, read_varint, read):
+        # Read a chunk header with the given readers. Returns the token count
+        # (0 at the end of the stream), the id width and the sizes of the
+        # length and text blocks.
+        count = read_varint()
+        if not count:
+            return 0, 0, 0, 0
+        for _ in range(read_varint()):
+            name = bytes(read(read_varint()))
+            try:
+                self.types.append(string_to_tokentype(name.decode("ascii")))
+            except (AttributeError, UnicodeDecodeError):
+                raise ValueError(f"bad token type {name!r} in SV token stream") from None
+            self._known = bytes(range(1, min(len(self.types), 0x100)))
+        width = read(1)[0]
+        if width not in (1, 2):
+            raise ValueError(f"bad type id width {width} in SV token stream")
+        return count, width, read_varint(), read_varint()
+
+    def chunk(self, block, count, width, lengths_size, text_size):
+        # Decode a chunk from the memoryview ``block``. Returns the chunk
+        # text, the type of every token and the token boundaries in the text.
+        ids_size = count * width
+        if len(block) != ids_size + lengths_size + text_size:
+            raise ValueError("truncated SV token stream")
+        ids = block[:ids_size]
+        if width == 2:
+            ids = ids.cast("H") if sys.byteorder == "little" else \
+                _to_little_endian(array("H", ids))
+        lengths = _lengths(bytes(block[ids_size:ids_size + lengths_size]))
+        text_start = ids_size + lengths_size
+        text = _utf8_decode(block[text_start:text_start + text_size], "surrogatepass", True)[0]
+        bounds = list(accumulate(lengths, initial=0))
+        if len(bounds) != count + 1 or bounds[-1] != len(text):
+            raise ValueError("corrupt SV token stream")
+        if width == 1:
+            unknown = bytes(ids).translate(None, self._known)
+        else:
+            unknown = max(ids) >= len(self.types)
+        if unknown:
+            raise ValueError("unknown type id in SV token stream")
+        return text, map(self.types.__getitem__, ids), bounds
+
+
+def _chunks(data):
+    buf = memoryview(data)
+    _check_header(buf[:9])
+    decoder = _Decoder()
+    pos = 9
+
+    def read_varint():
+        nonlocal pos
+        try:
+            value, pos = _read_varint(buf, pos)
+        except IndexError:
+            raise ValueError("truncated SV token stream") from None
+        return value
+
+    def read(n):
+        nonlocal pos
+        if pos + n > len(buf):
+            raise ValueError("truncated SV token stream")
+        pos += n
+        return buf[pos - n:pos]
+
+    while True:
+        count, width, lengths_size, text_size = decoder.header(read_varint, read)
+        if not count:
+            return
+        size = count * width + lengths_size + text_size
+        yield decoder.chunk(read(size), count, width, lengths_size, text_size)
+
+
+def iter_chunks(data):
+    # Yield a (text, spans) pair for every chunk of the stream in the
+    # bytes-like ``data``, where spans is an iterator of (tokentype, start,
+    # end) over text. Nothing but the chunk text is copied out of ``data``.
+    for text, types, bounds in _chunks(data):
+        yield text, zip(types, bounds, bounds[1:])
+
+
+def _read_varint_from(infile):
+    result = shift = 0
+    while True:
+        byte = infile.read(1)
+        if not byte:
+            raise ValueError("truncated SV token stream")
+        result |= (byte[0] & 0x7F) << shift
+        if byte[0] < 0x80:
+            return result
+        shift += 7
+
+
+def _file_chunks(infile):
+    _check_header(infile.read(9))
+    decoder = _Decoder()
+
+    def read(n):
+        data = infile.read(n)
+        if len(data) != n:
+            raise ValueError("truncated SV token stream")
+        return data
+
+    while True:
+        count, width, lengths_size, text_size = decoder.header(
+            lambda: _read_varint_from(infile), read)
+        if not count:
+            return
+        block = memoryview(read(count * width + lengths_size + text_size))
+        yield decoder.chunk(block, count, width, lengths_size, text_size)
+
+
+def iter_file_chunks(infile):
+    # Like iter_chunks(), reading one chunk at a time from a binary file.
+    for text, types, bounds in _file_chunks(infile):
+        yield text, zip(types, bounds, bounds[1:])
+
+
+def _values(text, types, bounds):
+    return zip(types, map(text.__getitem__, map(slice, bounds, bounds[1:])))
+
+
+def iter_tokens(infile):
+    # Yield the (tokentype, value) pairs of a stream read from a binary file.
+    for chunk in _file_chunks(infile):
+        yield from _values(*chunk)
+
+
+def dumps(tokens, chunk_tokens=4096):
+    out = BytesIO()
+    writer = StreamWriter(out, chunk_tokens)
+    writer.write_tokens(tokens)
+    writer.close()
+    return out.getvalue()
+
+
+def loads(data):
+    tokens = []
+    for chunk in _chunks(data):
+        tokens += _values(*chunk)
+    return tokens
+
+
+def _best_time(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    from sv_compare import find_sources
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="+", metavar="PATH")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    lexer = SVLexer()
+    texts = []
+    for path in find_sources(args.paths):
+        with open(path, encoding="utf-8", errors="replace") as f:
+            texts.append(lexer._preprocess_lexer_input(f.read()))
+    tokens = [list(lexer.get_tokens(text)) for text in texts]
+    spans = [list(lexer.get_spans(text)) for text in texts]
+
+    def encode_spans():
+        out = []
+        for text, file_spans in zip(texts, spans):
+            buf = BytesIO()
+            writer = StreamWriter(buf)
+            writer.write_spans(text, file_spans)
+            writer.close()
+            out.append(buf.getvalue())
+        return out
+
+    pickled = [pickle.dumps(t, pickle.HIGHEST_PROTOCOL) for t in tokens]
+    streams = [dumps(t) for t in tokens]
+    if [loads(s) for s in streams] != tokens or encode_spans() != streams:
+        print("token streams do not round-trip", file=sys.stderr)
+        return 1
+
+    rows = [
+        ("pickle dumps", _best_time(lambda: [pickle.dumps(t, pickle.HIGHEST_PROTOCOL)
+                                            for t in tokens], args.repeat)),
+        ("pickle loads", _best_time(lambda: [pickle.loads(p) for p in pickled], args.repeat)),
+        ("stream dumps", _best_time(lambda: [dumps(t) for t in tokens], args.repeat)),
+        ("stream dumps from spans", _best_time(encode_spans, args.repeat)),
+        ("stream loads", _best_time(lambda: [loads(s) for s in streams], args.repeat)),
+        ("stream spans", _best_time(lambda: [[list(spans) for _, spans in iter_chunks(s)]
+                                            for s in streams], args.repeat)),
+    ]
+    count = sum(len(t) for t in tokens)
+    print(f"{len(texts)} files, {count} tokens, {sum(map(len, texts))} characters")
+    print(f"pickle {sum(map(len, pickled))} bytes, stream {sum(map(len, streams))} bytes")
+    for name, seconds in rows:
+        print(f"{name:24s} {seconds * 1000:9.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
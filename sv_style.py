@@ -1,5 +1,7 @@
 """An SV plugin style for Pygments."""
 
+from types import MappingProxyType
+
 from pygments.style import Style
 from pygments.token import Token
 
@@ -425,6 +427,16 @@ colors = {
     },
 }
 
+def frozen(style):
+    # StyleMeta precomputes the style of every token type when the class is
+    # created. Freezing that table makes the class safe to share between
+    # threads: nothing can change it once the module is imported.
+    style._styles = MappingProxyType(
+        {ttype: tuple(definition) for ttype, definition in style._styles.items()})
+    return style
+
+
+@frozen
 class SVStyleLight(Style):
     styles = {
         Comment: colors['Green'][700],
@@ -448,6 +460,7 @@ class SVStyleLight(Style):
     }
 
 
+@frozen
 class SVStyleDark(Style):
     styles = {
         Comment: f"italic {colors['Green'][300]}",
@@ -0,0 +1,172 @@
+"""A terminal formatter for the SV styles.
+
+The ANSI escape of every token type is worked out once per formatter, with
+the style's hex colors mapped to the nearest xterm 256-color entry (or kept
+as 24-bit colors with ``truecolor``). Tokens are written in runs: a new
+escape is only emitted when the type's escape differs from the one already
+in effect, or after a newline, before which colors are always reset. Output
+is handed to the file in large chunks.
+
+    pygmentize -l sv -f sv-terminal -O style=sv-style-dark big.sv | less -R
+"""
+
+import codecs
+import os
+from types import MappingProxyType
+
+from pygments.formatter import Formatter
+from pygments.token import STANDARD_TYPES
+from pygments.util import get_bool_opt, get_int_opt
+
+from sv_lexer import SV_TYPES
+
+RESET = "\x1b[0m"
+
+# Channel levels of the 6x6x6 color cube at xterm colors 16-231.
+_CUBE = (0, 95, 135, 175, 215, 255)
+
+
+def _rgb(color):
+    color = color.lstrip("#")
+    if len(color) == 3:
+        color = "".join(c * 2 for c in color)
+    return int(color[0:2], 16), int(color[2:4], 16), int(color[4:6], 16)
+
+
+def _nearest_level(value):
+    return min(range(6), key=lambda i: abs(_CUBE[i] - value))
+
+
+def xterm256(color):
+    # Index of the xterm 256-color entry closest to the hex ``color``. The
+    # 16 system colors are left out: terminals are free to redefine them.
+    r, g, b = _rgb(color)
+    levels = [_nearest_level(c) for c in (r, g, b)]
+    cube = 16 + 36 * levels[0] + 6 * levels[1] + levels[2]
+    cube_rgb = [_CUBE[i] for i in levels]
+    gray = min(max(round(((r + g + b) / 3 - 8) / 10), 0), 23)
+    gray_value = 8 + 10 * gray
+
+    def distance(rgb):
+        return sum((x - y) ** 2 for x, y in zip(rgb, (r, g, b)))
+
+    if distance((gray_value,) * 3) < distance(cube_rgb):
+        return 232 + gray
+    return cube
+
+
+def wrap(chunk, escape):
+    # ``chunk`` in the colors of ``escape``, reset before each newline and
+    # set again after it, so that no line starts with colors left open by
+    # the one before it (which less -R loses when it scrolls or jumps).
+    if not escape or not chunk:
+        return chunk
+    if "\n" not in chunk:
+        return escape + chunk + RESET
+    return "\n".join(escape + line + RESET if line else ""
+                     for line in chunk.split("\n"))
+
+
+def escape_for(style, ttype, truecolor=False):
+    # The escape sequence that switches the terminal to the style of
+    # ``ttype``, or "" for text that is left in the default colors.
+    while not style.styles_token(ttype):
+        ttype = ttype.parent
+    definition = style.style_for_token(ttype)
+    codes = []
+    if definition["bold"]:
+        codes.append("1")
+    if definition["italic"]:
+        codes.append("3")
+    if definition["underline"]:
+        codes.append("4")
+    for key, layer in (("color", "38"), ("bgcolor", "48")):
+        color = definition[key]
+        if not color:
+            continue
+        if truecolor:
+            codes.append(layer + ";2;%d;%d;%d" % _rgb(color))
+        else:
+            codes.append(layer + ";5;%d" % xterm256(color))
+    return "\x1b[" + ";".join(codes) + "m" if codes else ""
+
+
+class SVTerminalFormatter(Formatter):
+    name = "SystemVerilog Terminal"
+
+    aliases = ["sv-terminal", "systemverilog-terminal"]
+
+    filenames = []
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        # 24-bit colors by default only where the terminal says it has them.
+        self.truecolor = get_bool_opt(
+            options, "truecolor", os.environ.get("COLORTERM") in ("truecolor", "24bit"))
+        # Characters collected before they are written to the output.
+        self.buffersize = get_int_opt(options, "buffersize", 1 << 16)
+        # Read-only after this point, like SVFormatter's table.
+        self._escapes = MappingProxyType({
+            ttype: escape_for(self.style, ttype, self.truecolor)
+            for ttype in set(SV_TYPES) | set(STANDARD_TYPES)
+        })
+
+    def format_unencoded(self, tokensource, outfile):
+        # Tokens with the same escape are written as one run. Empty tokens
+        # are skipped, as they never make it into spans.
+        escapes = self._escapes
+        buffersize = self.buffersize
+        write = outfile.write
+        parts = []
+        size = 0
+        current = ""
+        run = []
+        for ttype, value in tokensource:
+            if not value:
+                continue
+            escape = escapes.get(ttype)
+            if escape is None:
+                escape = escape_for(self.style, ttype, self.truecolor)
+            if escape != current and run:
+                parts.append(wrap("".join(run), current))
+                run = []
+                if size >= buffersize:
+                    write("".join(parts))
+                    parts = []
+                    size = 0
+            current = escape
+            run.append(value)
+            size += len(value)
+        parts.append(wrap("".join(run), current))
+        write("".join(parts))
+
+    def format_spans(self, text, spans, outfile):
+        # Same output as format(), from the (tokentype, start, end) spans of
+        # SVLexer.get_spans over ``text``. Adjacent spans with the same escape
+        # are written as one slice of the text.
+        if self.encoding:
+            outfile = codecs.lookup(self.encoding)[3](outfile)
+        escapes = self._escapes
+        buffersize = self.buffersize
+        write = outfile.write
+        parts = []
+        size = 0
+        current = ""
+        run = end = 0
+        for ttype, start, end in spans:
+            escape = escapes.get(ttype)
+            if escape is None:
+                escape = escape_for(self.style, ttype, self.truecolor)
+            if escape == current:
+                continue
+            if start > run:
+                parts.append(wrap(text[run:start], current))
+                size += start - run
+                if size >= buffersize:
+                    write("".join(parts))
+                    parts = []
+                    size = 0
+            run = start
+            current = escape
+        parts.append(wrap(text[run:end], current))
+        write("".join(parts))
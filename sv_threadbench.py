@@ -0,0 +1,125 @@
+"""Multi-threaded highlighting benchmark.
+
+Highlights a corpus from several threads at once, either with one lexer,
+formatter and style shared by every thread ("shared") or with new instances
+for every file ("fresh", which is what a server that does not trust the
+instances would do). Every result is compared with a single-threaded
+reference, so the run doubles as a check that shared instances are safe.
+
+    python sv_threadbench.py [--threads 1,2,4,8] [--rounds N] [--json] PATH...
+
+On a free-threaded build (python3.13t and later) the threads run in parallel;
+the report says whether the GIL was enabled during the run.
+"""
+
+import argparse
+import json
+import os
+import sys
+import sysconfig
+import threading
+import time
+
+from pygments import highlight
+from pygments.formatters import HtmlFormatter
+
+from sv_compare import find_sources
+from sv_formatter import SVFormatter
+from sv_lexer import SVLexer
+from sv_style import SVStyleDark
+
+FORMATTERS = {
+    "sv": lambda: SVFormatter(style=SVStyleDark),
+    "html": lambda: HtmlFormatter(style=SVStyleDark),
+}
+
+
+def gil_enabled():
+    is_enabled = getattr(sys, "_is_gil_enabled", None)
+    return True if is_enabled is None else is_enabled()
+
+
+def run(texts, threads, rounds, shared, make_formatter, reference):
+    lexer = SVLexer()
+    formatter = make_formatter()
+    mismatches = []
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(index):
+        barrier.wait()
+        for n in range(rounds):
+            # Spread the threads over the corpus so they do not all work on
+            # the same file at the same moment.
+            for k in range(len(texts)):
+                i = (k + index + n) % len(texts)
+                if shared:
+                    out = highlight(texts[i], lexer, formatter)
+                else:
+                    out = highlight(texts[i], SVLexer(), make_formatter())
+                if out != reference[i]:
+                    mismatches.append(i)
+        barrier.wait()
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    barrier.wait()
+    elapsed = time.perf_counter() - start
+    for t in pool:
+        t.join()
+    files = threads * rounds * len(texts)
+    return {
+        "threads": threads,
+        "mode": "shared" if shared else "fresh",
+        "seconds": elapsed,
+        "files_per_second": files / elapsed if elapsed else None,
+        "mismatches": len(mismatches),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="*", metavar="PATH",
+                        default=[os.path.join(os.path.dirname(__file__), "addr_policies.svh")])
+    parser.add_argument("--threads", default="1,2,4,8",
+                        help="comma separated thread counts")
+    parser.add_argument("--rounds", type=int, default=20,
+                        help="passes over the corpus per thread")
+    parser.add_argument("--formatter", choices=sorted(FORMATTERS), default="sv")
+    parser.add_argument("--json", action="store_true", help="print a JSON report")
+    args = parser.parse_args(argv)
+
+    texts = []
+    for path in find_sources(args.paths):
+        with open(path, encoding="utf-8", errors="replace") as f:
+            texts.append(f.read())
+    make_formatter = FORMATTERS[args.formatter]
+    reference = [highlight(text, SVLexer(), make_formatter()) for text in texts]
+
+    results = []
+    for threads in (int(n) for n in args.threads.split(",")):
+        for shared in (True, False):
+            results.append(run(texts, threads, args.rounds, shared, make_formatter, reference))
+
+    report = {
+        "python": sys.version,
+        "free_threaded_build": bool(sysconfig.get_config_var("Py_GIL_DISABLED")),
+        "gil_enabled": gil_enabled(),
+        "files": len(texts),
+        "results": results,
+    }
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        print(f"Python {sys.version.split()[0]}, GIL {'enabled' if report['gil_enabled'] else 'disabled'}")
+        for r in results:
+            print(f"{r['threads']:3d} threads  {r['mode']:6s}  {r['files_per_second']:10.1f} files/s"
+                  f"  {r['mismatches']} mismatches")
+    return 1 if any(r["mismatches"] for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
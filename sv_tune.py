@@ -0,0 +1,487 @@
+"""Rule-order tuning for SVLexer.
+
+The rules of each lexer state are tried in order and the first one that
+matches wins, so rules that match often but sit behind dozens of rare ones
+cost a failed regex call per rare rule, per token. This tool
+
+1. counts, over a corpus, how often each rule is the one that matches;
+2. works out, from the parsed regexes, the characters each rule can start a
+   match with, and the characters at which it is sure to match (``\s+`` at
+   any whitespace, say). Two rules that cannot start a match at the same
+   character can never both match at the same position, so their relative
+   order does not matter; and a rule never wins at a character an earlier
+   rule is sure to match at;
+3. puts the rules of every state in order of hits, moving a rule ahead of
+   another only when the two are disjoint in that sense;
+4. lexes the corpus and random fragments with both orders and checks that
+   the tokens are identical, times both orders, and only then writes the
+   order to sv_tuned.py, naming the files it was tuned on.
+
+SVLexer itself always tries the rules in table order; sv_lexer.TunedSVLexer
+is the same lexer with the order from sv_tuned.py. Whether that pays off
+depends on how close the corpus is to the code being highlighted, so tune on
+a representative corpus and check the times reported here before using it.
+
+    python sv_tune.py [--output sv_tuned.py] [--fuzz N] PATH...
+
+Rules that can match the empty string are treated as overlapping with every
+other rule and never move past one.
+"""
+
+import argparse
+import random
+import re
+import sys
+import time
+from collections import Counter
+from pprint import pformat
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_constants
+    import sre_parse
+
+from pygments.lexer import RegexLexer
+
+from sv_compare import find_sources
+from sv_fuzz import fragment
+from sv_lexer import SVLexer, rules_fingerprint
+
+# First-character sets are bit masks: bit c for each ASCII character c, and
+# four more bits for the characters above 127, which are only told apart by
+# whether they are whitespace, digits, other word characters or none of those.
+NON_ASCII_SPACE = 1 << 128
+NON_ASCII_DIGIT = 1 << 129
+NON_ASCII_WORD = 1 << 130
+NON_ASCII_OTHER = 1 << 131
+NON_ASCII = NON_ASCII_SPACE | NON_ASCII_DIGIT | NON_ASCII_WORD | NON_ASCII_OTHER
+ANY = (1 << 132) - 1
+LETTERS = sum(1 << ord(c) for c in "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz")
+
+
+def _mask(chars):
+    mask = 0
+    for c in chars:
+        if c < 128:
+            mask |= 1 << c
+        elif chr(c).isspace():
+            mask |= NON_ASCII_SPACE
+        elif re.match(r"\d", chr(c)):
+            mask |= NON_ASCII_DIGIT
+        elif re.match(r"\w", chr(c)):
+            mask |= NON_ASCII_WORD
+        else:
+            mask |= NON_ASCII_OTHER
+    return mask
+
+
+def _category_mask(pattern, non_ascii):
+    return _mask(c for c in range(128) if re.match(pattern, chr(c))) | non_ascii
+
+
+_CATEGORIES = {
+    sre_constants.CATEGORY_DIGIT: _category_mask(r"\d", NON_ASCII_DIGIT),
+    sre_constants.CATEGORY_NOT_DIGIT: _category_mask(r"\D", NON_ASCII & ~NON_ASCII_DIGIT),
+    sre_constants.CATEGORY_SPACE: _category_mask(r"\s", NON_ASCII_SPACE),
+    sre_constants.CATEGORY_NOT_SPACE: _category_mask(r"\S", NON_ASCII & ~NON_ASCII_SPACE),
+    sre_constants.CATEGORY_WORD: _category_mask(r"\w", NON_ASCII_DIGIT | NON_ASCII_WORD),
+    sre_constants.CATEGORY_NOT_WORD: _category_mask(r"\W", NON_ASCII_SPACE | NON_ASCII_OTHER),
+}
+
+_ZERO_WIDTH = (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT)
+_REPEATS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT,
+            getattr(sre_constants, "POSSESSIVE_REPEAT", sre_constants.MAX_REPEAT))
+_ATOMIC = getattr(sre_constants, "ATOMIC_GROUP", None)
+_ONE_CHARACTER = (sre_constants.LITERAL, sre_constants.NOT_LITERAL, sre_constants.ANY,
+                  sre_constants.IN)
+
+
+def _ignore_case(mask):
+    for c in range(128):
+        if mask >> c & 1 and chr(c).isalpha():
+            mask |= 1 << ord(chr(c).swapcase())
+    # A few letters above 127 match ASCII ones when case is ignored (the
+    # Kelvin sign and k, say).
+    if mask & LETTERS:
+        mask |= NON_ASCII_WORD
+    if mask & NON_ASCII_WORD:
+        mask |= LETTERS
+    return mask
+
+
+def _class_mask(items):
+    mask = 0
+    negate = False
+    for op, av in items:
+        if op is sre_constants.NEGATE:
+            negate = True
+        elif op is sre_constants.LITERAL:
+            mask |= _mask((av,))
+        elif op is sre_constants.RANGE:
+            lo, hi = av
+            mask |= _mask(range(lo, min(hi, 128) + 1))
+            if hi >= 128:
+                mask |= NON_ASCII
+        elif op is sre_constants.CATEGORY and av in _CATEGORIES:
+            mask |= _CATEGORIES[av]
+        else:
+            return ANY
+    if negate:
+        mask = (ANY & ~mask) | NON_ASCII
+    return mask
+
+
+def _first(items, flags):
+    # Return (mask, nullable) for a parsed sequence: the characters a match
+    # can start with, and whether it can match the empty string. Both err
+    # on the side of more characters and of nullable.
+    mask = 0
+    for op, av in items:
+        nullable = False
+        if op is sre_constants.LITERAL:
+            m = _mask((av,))
+        elif op is sre_constants.NOT_LITERAL:
+            m = (ANY & ~_mask((av,))) | NON_ASCII
+        elif op is sre_constants.ANY:
+            m = ANY if flags & re.DOTALL else ANY & ~_mask((10,))
+        elif op is sre_constants.IN:
+            m = _class_mask(av)
+        elif op is sre_constants.SUBPATTERN:
+            m, nullable = _first(av[-1], flags | av[1])
+        elif op is _ATOMIC:
+            m, nullable = _first(av, flags)
+        elif op is sre_constants.BRANCH:
+            m = 0
+            for branch in av[1]:
+                bm, bn = _first(branch, flags)
+                m |= bm
+                nullable = nullable or bn
+        elif op in _REPEATS:
+            m, nullable = _first(av[2], flags)
+            nullable = nullable or av[0] == 0
+        elif op in _ZERO_WIDTH:
+            # Assertions only narrow down where a rule matches; leaving them
+            # out gives a superset.
+            m, nullable = 0, True
+        else:
+            return ANY, True
+        if flags & re.IGNORECASE:
+            m = _ignore_case(m)
+        mask |= m
+        if not nullable:
+            return mask, False
+    return mask, True
+
+
+def _always(items, flags):
+    # The ASCII characters at which a parsed sequence matches whatever
+    # follows them. Errs on the side of fewer characters.
+    if not items:
+        return 0
+    op, av = items[0]
+    for rest_op, rest_av in items[1:]:
+        # What follows the first item has to be able to match nothing.
+        if rest_op not in _REPEATS or rest_av[0] != 0:
+            return 0
+    if op is sre_constants.LITERAL:
+        m = _mask((av,))
+    elif op is sre_constants.ANY:
+        m = ANY if flags & re.DOTALL else ANY & ~_mask((10,))
+    elif op is sre_constants.IN:
+        if flags & re.IGNORECASE and av and av[0][0] is sre_constants.NEGATE:
+            return 0
+        m = _class_mask(av)
+    elif op is sre_constants.SUBPATTERN:
+        m = _always(av[-1], flags | av[1])
+    elif op is sre_constants.BRANCH:
+        m = 0
+        for branch in av[1]:
+            m |= _always(branch, flags)
+    elif op in _REPEATS and av[0] >= 1:
+        m = _always(av[2], flags)
+    else:
+        return 0
+    if flags & re.IGNORECASE:
+        m = _ignore_case(m)
+    return m & ~NON_ASCII
+
+
+def _reads(items, flags):
+    # Return (newlines, fixed, run, mask) for a parsed sequence: how many
+    # "\n" an attempt to match it can read past (None for any number), how
+    # many characters it can read outside repeats without an upper bound,
+    # the characters those repeats can read, and all the characters it can
+    # read. All of them err on the side of more.
+    newlines = fixed = 0
+    run = mask = 0
+    for op, av in items:
+        if op in _ONE_CHARACTER:
+            if op is sre_constants.LITERAL:
+                m = _mask((av,))
+            elif op is sre_constants.NOT_LITERAL:
+                m = (ANY & ~_mask((av,))) | NON_ASCII
+            elif op is sre_constants.ANY:
+                m = ANY if flags & re.DOTALL else ANY & ~_mask((10,))
+            else:
+                m = _class_mask(av)
+            if flags & re.IGNORECASE:
+                m = _ignore_case(m)
+            n, f, r = m >> 10 & 1, 1, 0
+        elif op is sre_constants.SUBPATTERN:
+            n, f, r, m = _reads(av[-1], flags | av[1])
+        elif op is _ATOMIC:
+            n, f, r, m = _reads(av, flags)
+        elif op is sre_constants.BRANCH:
+            n = f = r = m = 0
+            for branch in av[1]:
+                bn, bf, br, bm = _reads(branch, flags)
+                n = None if n is None or bn is None else max(n, bn)
+                f = max(f, bf)
+                r |= br
+                m |= bm
+        elif op in _REPEATS:
+            n, f, r, m = _reads(av[2], flags)
+            if av[1] == sre_constants.MAXREPEAT:
+                n = None if n or m >> 10 & 1 else 0
+                f, r = 0, m
+            else:
+                n = n and n * av[1]
+                f *= av[1]
+        elif op is sre_constants.ASSERT or op is sre_constants.ASSERT_NOT:
+            if av[0] < 0:
+                # A lookbehind reads before the start.
+                return None, 0, ANY, ANY
+            n, f, r, m = _reads(av[1], flags)
+        elif op is sre_constants.AT:
+            n = f = r = m = 0
+        else:
+            return None, 0, ANY, ANY
+        newlines = None if newlines is None or n is None else newlines + n
+        fixed += f
+        run |= r
+        mask |= m
+    return newlines, fixed, run, mask
+
+
+def _parse(regex, flags):
+    parsed = sre_parse.parse(regex, flags)
+    state = getattr(parsed, "state", None) or parsed.pattern
+    return list(parsed), flags | state.flags
+
+
+def first_chars(regex, flags=0):
+    # The characters a match of ``regex`` can start with, as a mask; ANY if
+    # it can match the empty string.
+    mask, nullable = _first(*_parse(regex, flags))
+    return ANY if nullable else mask
+
+
+def always_chars(regex, flags=0):
+    # The ASCII characters, as a mask, at which ``regex`` is sure to match.
+    return _always(*_parse(regex, flags))
+
+
+def reads(regex, flags=0):
+    # How far an attempt to match ``regex`` can read past where it starts,
+    # as (newlines, fixed, mask): past at most ``newlines`` "\n", or when
+    # that is None, past any number of characters in ``mask`` and at most
+    # ``fixed`` others.
+    newlines, fixed, run, _ = _reads(*_parse(regex, flags))
+    return newlines, fixed, run
+
+
+def single_run(regex, flags=0):
+    # Whether ``regex`` is one greedy repeat of a single character set,
+    # possibly in a group. Such a regex reads one character past the end of
+    # its match, or none past its start when it fails.
+    items, _ = _parse(regex, flags)
+    while len(items) == 1 and items[0][0] is sre_constants.SUBPATTERN:
+        items = list(items[0][1][-1])
+    return (len(items) == 1 and items[0][0] is sre_constants.MAX_REPEAT
+            and len(items[0][1][2]) == 1 and items[0][1][2][0][0] in _ONE_CHARACTER)
+
+
+def char_class(mask):
+    # A regex character class matching at least the characters in ``mask``.
+    chars = "".join(re.escape(chr(c)) for c in range(128) if mask >> c & 1)
+    if mask & NON_ASCII:
+        chars += "\x80-\U0010ffff"
+    return "[" + chars + "]" if chars else "(?!)"
+
+
+def tuned_order(regexes, hits, flags=0):
+    # Order rule indices so that rules with many hits come early, keeping
+    # every rule after the earlier rules it may overlap with.
+    #
+    # A rule only wins at characters no earlier rule is sure to match at, so
+    # its first characters are narrowed down to those (``live``) as long as
+    # the rules it was narrowed by stay ahead of it. Two rules can then swap
+    # when their live characters are disjoint.
+    first = [first_chars(regex, flags) for regex in regexes]
+    always = [always_chars(regex, flags) for regex in regexes]
+    live = []
+    for i in range(len(regexes)):
+        taken = 0
+        for j in range(i):
+            taken |= always[j]
+        live.append(first[i] & ~taken)
+
+    def overlaps(i, j):
+        # Whether rule i has to stay after the earlier rule j.
+        return live[i] & live[j] or first[i] & always[j]
+
+    # Everything rule i has to stay after, directly or not.
+    ahead = []
+    for i in range(len(regexes)):
+        rules = set()
+        for j in range(i):
+            if overlaps(i, j):
+                rules |= ahead[j] | {j}
+        ahead.append(rules)
+
+    # Move up the rule that, together with the rules it has to stay after,
+    # has the most hits per rule; a hot rule stuck behind a cold one takes
+    # the cold one along.
+    placed = []
+    remaining = set(range(len(regexes)))
+    while remaining:
+        best = None
+        for i in sorted(remaining):
+            group = sorted(ahead[i] & remaining | {i})
+            density = sum(hits.get(j, 0) for j in group) / len(group)
+            if best is None or density > best[0]:
+                best = density, group
+        placed.extend(best[1])
+        remaining.difference_update(best[1])
+    return placed
+
+
+def lexer_class(rule_order):
+    # An SVLexer subclass that tries its rules in ``rule_order`` ({} for the
+    # order the table is written in).
+    return type("OrderedSVLexer", (SVLexer,), {"rule_order": rule_order})
+
+
+def count_matches(texts, rule_order):
+    # Lex ``texts`` with the rules tried in ``rule_order`` and return
+    # ({state: Counter(rule position -> matches)}, regex calls made).
+    lexer = lexer_class(rule_order)(accelerate=False)
+    hits = {state: Counter() for state in lexer._tokens}
+    calls = Counter()
+    counting = {}
+    for state, rules in lexer._tokens.items():
+        wrapped = []
+        for index, (rexmatch, action, new_state) in enumerate(rules):
+            def match(text, pos, rexmatch=rexmatch, counter=hits[state], index=index):
+                calls[None] += 1
+                m = rexmatch(text, pos)
+                if m:
+                    counter[index] += 1
+                return m
+            wrapped.append((match, action, new_state))
+        counting[state] = tuple(wrapped)
+    lexer._tokens = counting
+    for text in texts:
+        for _ in RegexLexer.get_tokens_unprocessed(lexer, text):
+            pass
+    return hits, calls[None]
+
+
+def rule_order(hits):
+    # Return {state: (fingerprint, order)} for every state whose order
+    # changes.
+    tokendefs = SVLexer.get_tokendefs()
+    orders = {}
+    for state, rules in tokendefs.items():
+        order = tuned_order([rule[0] for rule in rules], hits.get(state, {}), SVLexer.flags)
+        if order != list(range(len(rules))):
+            orders[state] = (rules_fingerprint(rules, SVLexer.flags), tuple(order))
+    return orders
+
+
+def differences(texts, order):
+    # Return the texts that lex differently with ``order``.
+    plain = lexer_class({})(accelerate=False)
+    lexers = [lexer_class(order)(accelerate=accelerate) for accelerate in (False, True)]
+    failing = []
+    for text in texts:
+        reference = list(plain.get_tokens_unprocessed(text))
+        if any(list(lexer.get_tokens_unprocessed(text)) != reference for lexer in lexers):
+            failing.append(text)
+    return failing
+
+
+def lex_times(lexers, texts, repeat=5):
+    # Best time of each lexer over ``texts``. The lexers take turns, so that
+    # a slow patch of the machine does not land on only one of them.
+    best = [None] * len(lexers)
+    for _ in range(repeat):
+        for n, lexer in enumerate(lexers):
+            start = time.perf_counter()
+            for text in texts:
+                for _ in lexer.get_tokens_unprocessed(text):
+                    pass
+            elapsed = time.perf_counter() - start
+            best[n] = elapsed if best[n] is None else min(best[n], elapsed)
+    return best
+
+
+def write_module(path, order, sources):
+    # ``sources`` are the (path, text) pairs of the corpus, listed in the
+    # docstring so that the order can be traced back to what it was tuned on.
+    counts = [(source, text.count("\n")) for source, text in sources]
+    with open(path, "w") as f:
+        f.write('"""Rule order for TunedSVLexer, generated by sv_tune.py; do not edit.\n\n'
+                f'Tuned on {len(counts)} file(s), {sum(n for _, n in counts)} lines:\n\n')
+        for source, lines in counts:
+            f.write(f"    {source} ({lines} lines)\n")
+        f.write('\nEach state maps to the fingerprint of its rules and the indices of\n'
+                'the rules in the order to try them.\n"""\n\n')
+        f.write("RULE_ORDER = " + pformat(order, width=100, compact=True) + "\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="+", metavar="PATH")
+    parser.add_argument("--output", default=None,
+                        help="where to write the order (default: only report)")
+    parser.add_argument("--fuzz", type=int, default=2000,
+                        help="random fragments to check besides the corpus")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    sources = []
+    for path in find_sources(args.paths):
+        with open(path, encoding="utf-8", errors="replace") as f:
+            sources.append((path, f.read()))
+    texts = [text for _, text in sources]
+    hits, calls = count_matches(texts, {})
+    order = rule_order(hits)
+    for state, (_, indices) in sorted(order.items()):
+        moved = [i for n, i in enumerate(indices) if i != n]
+        print(f"{state}: {len(moved)} of {len(indices)} rules move, "
+              f"now {list(indices[:8])}...")
+
+    rng = random.Random(args.seed)
+    checks = texts + [fragment(rng) for _ in range(args.fuzz)]
+    failing = differences(checks, order)
+    if failing:
+        for text in failing[:5]:
+            print(f"lexes differently: {text[:200]!r}", file=sys.stderr)
+        return 1
+
+    print(f"regex calls: {calls} -> {count_matches(texts, order)[1]}")
+    for accelerate in (False, True):
+        before, after = lex_times([lexer_class({})(accelerate=accelerate),
+                                   lexer_class(order)(accelerate=accelerate)], texts)
+        print(f"accelerate={accelerate}: {before:.3f}s -> {after:.3f}s "
+              f"({before / after:.2f}x)")
+    if args.output:
+        write_module(args.output, order, sources)
+        print(f"wrote {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())